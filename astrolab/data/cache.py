@@ -0,0 +1,127 @@
+from typing import List, Union, Tuple, Optional, Dict
+import os, json, time, shutil, hashlib, threading
+import traitlets as tl
+import traitlets.config as tlc
+from astrolab.model.base import AstroSingleton
+from .manager import DataManager
+
+def copy_path( src: str, dst: str ):
+    if os.path.isdir( src ):    shutil.copytree( src, dst )
+    else:                       shutil.copy2( src, dst )
+
+def link_path( src: str, dst: str ):
+    # Files are hard linked where the file system allows it, directories ( zarr stores ) are copied
+    if not os.path.isdir( src ):
+        try: return os.link( src, dst )
+        except OSError: pass
+    copy_path( src, dst )
+
+def remove_path( path: str ):
+    if os.path.isdir( path ):       shutil.rmtree( path )
+    elif os.path.exists( path ):    os.remove( path )
+
+def path_size( path: str ) -> int:
+    if not os.path.isdir( path ): return os.path.getsize( path )
+    return sum( os.path.getsize( os.path.join( root, f ) ) for root, dirs, files in os.walk( path ) for f in files )
+
+class ResultCache(tlc.SingletonConfigurable,AstroSingleton):
+    enabled = tl.Bool( True ).tag(config=True)
+    max_size = tl.Float( 10.0 ).tag(config=True)
+    fingerprint_block_size = tl.Int( 2**24 ).tag(config=True)
+    max_fingerprints = tl.Int( 1000 ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(ResultCache, self).__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str,str] = None
+
+    @property
+    def cacheDir(self) -> str:
+        cdir = os.path.join( DataManager.instance().cache_dir, "results" )
+        os.makedirs( cdir, exist_ok=True )
+        return cdir
+
+    @property
+    def fingerprints_file(self) -> str:
+        return os.path.join( self.cacheDir, "fingerprints.json" )
+
+    def fingerprint( self, file_path: str ) -> str:
+        fstat = os.stat( file_path )
+        fpid = f"{os.path.realpath(file_path)}:{fstat.st_mtime}:{fstat.st_size}"
+        with self._lock:
+            if self._fingerprints is None:
+                try:
+                    with open( self.fingerprints_file ) as f: self._fingerprints = json.load( f )
+                except Exception: self._fingerprints = {}
+            digest = self._fingerprints.get( fpid )
+        if digest is None:
+            t0 = time.time()
+            hasher = hashlib.blake2b( digest_size=20 )
+            with open( file_path, 'rb' ) as f:
+                for block in iter( lambda: f.read( self.fingerprint_block_size ), b'' ): hasher.update( block )
+            digest = hasher.hexdigest()
+            print( f"Computed fingerprint of {file_path} in {time.time()-t0:.2f} sec")
+            with self._lock:
+                self.prune_fingerprints( os.path.realpath(file_path) )
+                self._fingerprints[ fpid ] = digest
+                with open( self.fingerprints_file, "w" ) as f: json.dump( self._fingerprints, f )
+        return digest
+
+    def prune_fingerprints( self, real_path: str ):
+        stale = [ fpid for fpid in self._fingerprints.keys() if fpid.rsplit( ':', 2 )[0] == real_path ]
+        for fpid in stale: del self._fingerprints[ fpid ]
+        while len( self._fingerprints ) >= self.max_fingerprints:
+            del self._fingerprints[ next( iter( self._fingerprints ) ) ]
+
+    def key( self, file_paths: List[str], **params ) -> str:
+        hasher = hashlib.blake2b( digest_size=20 )
+        for file_path in file_paths: hasher.update( self.fingerprint( file_path ).encode() )
+        hasher.update( json.dumps( params, sort_keys=True, default=str ).encode() )
+        return hasher.hexdigest()
+
+    def entryPath( self, key: str, output_file: str ) -> str:
+        return os.path.join( self.cacheDir, key + os.path.splitext( output_file )[1] )
+
+    def get( self, key: str, output_file: str ) -> Optional[str]:
+        if not self.enabled: return None
+        entry = self.entryPath( key, output_file )
+        if not os.path.exists( entry ): return None
+        # The access time orders entries for gc, the modification time is left alone so that the signatures stay comparable
+        os.utime( entry, ( time.time(), os.stat( entry ).st_mtime ) )
+        if self.isRestored( entry, output_file ):
+            print( f"Cached result {key} is already in {output_file}")
+        else:
+            remove_path( output_file )
+            link_path( entry, output_file )
+            print( f"Restored cached result {key} to {output_file}")
+        return output_file
+
+    @classmethod
+    def isRestored( cls, entry: str, output_file: str ) -> bool:
+        if os.path.realpath( entry ) == os.path.realpath( output_file ): return True
+        if not os.path.exists( output_file ) or ( os.path.isdir( entry ) != os.path.isdir( output_file ) ): return False
+        return DataManager.fileSignature( entry ) == DataManager.fileSignature( output_file )
+
+    def put( self, key: str, output_file: str ):
+        if not self.enabled: return
+        entry = self.entryPath( key, output_file )
+        remove_path( entry )
+        link_path( output_file, entry )
+        print( f"Cached result {key} from {output_file}")
+        self.gc()
+
+    def gc( self ):
+        max_bytes = self.max_size * 2**30
+        entries = [ os.path.join( self.cacheDir, name ) for name in os.listdir( self.cacheDir ) if name != "fingerprints.json" ]
+        entries = sorted( [ ( os.stat( entry ).st_atime, path_size( entry ), entry ) for entry in entries ] )
+        total_size = sum( entry[1] for entry in entries )
+        for ( atime, size, entry ) in entries:
+            if total_size <= max_bytes: break
+            print( f"Evicting cached result {entry}, size = {size/2**20:.1f} MB")
+            remove_path( entry )
+            total_size -= size
+
+    def clear( self ):
+        for name in os.listdir( self.cacheDir ):
+            remove_path( os.path.join( self.cacheDir, name ) )
+        with self._lock: self._fingerprints = None
@@ -1,51 +1,229 @@
-from .manager import DataManager
 import xarray as xa
 import numpy as np
-import os, glob
+import os, glob, shutil
 from collections import OrderedDict
-from typing import List, Union, Tuple, Optional, Dict
+from typing import List, Union, Tuple, Optional, Dict, Callable
 from functools import partial
 from typing import Optional, Dict
 from astrolab.reduction.embedding import ReductionManager
+from .manager import DataManager
+from .cache import ResultCache
+
+def blocked( np_data: np.ndarray, block_size: int ):
+    if block_size <= 0: return np_data
+    import dask.array as da
+    return da.from_array( np_data, chunks=(block_size,) + np_data.shape[1:] )
 
-def getXarray(  id: str, xcoords: Dict, subsample: int, xdims:OrderedDict, **kwargs ) -> xa.DataArray:
-    np_data: np.ndarray = DataManager.instance().getInputFileData( id, subsample, tuple(xdims.keys()) )
-    dims, coords = [], {}
-    for iS in np_data.shape:
-        coord_name = xdims[iS]
-        dims.append( coord_name )
-        coords[ coord_name ] = xcoords[ coord_name ]
+def getXarray(  id: str, xcoords: Dict, subsample: int, dims: List[str], block_size: int = 0, **kwargs ) -> xa.DataArray:
+    np_data: np.ndarray = DataManager.instance().getInputFileData( id, subsample if 'samples' in dims else 1 )
+    return wrapXarray( id, np_data, xcoords, dims, block_size, **kwargs )
+
+def sample_dims( np_data: np.ndarray ) -> List[str]:
+    return [ 'samples', 'bands' ][ :np_data.ndim ]
+
+def wrapXarray(  id: str, np_data: np.ndarray, xcoords: Dict, dims: List[str], block_size: int = 0, **kwargs ) -> xa.DataArray:
+    np_data = blocked( np_data, block_size )
+    coords = { coord_name: xcoords[ coord_name ] for coord_name in dims }
     attrs = { **kwargs, 'name': id }
     return xa.DataArray( np_data, dims=dims, coords=coords, name=id, attrs=attrs )
 
-def prepare_inputs( input_vars, ssample = None ):
+def encode_categories( values: np.ndarray, categories: np.ndarray = None ) -> Tuple[np.ndarray,np.ndarray]:
+    import pandas as pd
+    values = np.asarray( values ).astype('U')
+    if categories is None:
+        cat = pd.Categorical( values )
+    else:
+        categories = np.asarray( categories ).astype('U')
+        new_categories = np.setdiff1d( np.unique( values ), categories )
+        cat = pd.Categorical( values, categories=np.concatenate( [ categories, new_categories ] ) )
+    return cat.codes.astype( np.int32 ), np.asarray( cat.categories ).astype('U')
+
+def compact_vars( data_vars: Dict[str,xa.DataArray], reference: xa.Dataset = None ) -> Dict[str,xa.DataArray]:
+    if not DataManager.instance().compact_dtypes: return data_vars
+    compacted = {}
+    for vid, xvar in data_vars.items():
+        if (reference is not None) and (vid in reference) and ('categories' not in reference[vid].attrs):
+            compacted[vid] = xvar.astype( reference[vid].dtype )
+        elif (xvar.dtype.kind == 'f') and (xvar.dtype.itemsize > 4):
+            compacted[vid] = xvar.astype( np.float32 )
+        elif (xvar.dtype.kind in 'USO') and (xvar.dims == ('samples',)):
+            catid = f"{vid}-categories"
+            categories = None if (reference is None) or (catid not in reference) else reference[catid].values
+            codes, categories = encode_categories( xvar.values, categories )
+            compacted[vid] = xa.DataArray( codes, dims=xvar.dims, coords=xvar.coords, name=xvar.name, attrs={ **xvar.attrs, 'categories': catid } )
+            compacted[catid] = xa.DataArray( categories, dims=[catid], name=catid )
+        else:
+            compacted[vid] = xvar
+    return compacted
+
+def dataset_extension() -> str:
+    return ".zarr" if DataManager.instance().dataset_format.lower() == "zarr" else ".nc"
+
+def zarr_encoding( dataset: xa.Dataset ) -> Dict[str,Dict]:
+    # zarr 3 takes a list of bytes-to-bytes codecs ( 'compressors' ), zarr 2 a single numcodecs compressor
+    import zarr
+    dataManager = DataManager.instance()
+    cname = dataManager.zarr_compressor.lower()
+    if int( zarr.__version__.split('.')[0] ) >= 3:
+        compressors = None if cname == "none" else zarr.codecs.BloscCodec( cname=cname, clevel=dataManager.zarr_compression_level, shuffle="bitshuffle" )
+        return { vname: dict( compressors=compressors ) for vname in dataset.data_vars }
+    import numcodecs
+    compressor = None if cname == "none" else numcodecs.Blosc( cname=cname, clevel=dataManager.zarr_compression_level, shuffle=numcodecs.Blosc.BITSHUFFLE )
+    return { vname: dict( compressor=compressor ) for vname in dataset.data_vars }
+
+def write_dataset( dataset: xa.Dataset, output_base: str, block_size: int = 0 ) -> str:
+    dataManager = DataManager.instance()
+    output_file = output_base + dataset_extension()
+    if output_file.endswith( ".zarr" ):
+        import dask
+        cname = dataManager.zarr_compressor.lower()
+        chunked_dataset = dataset.chunk( { 'samples': dataManager.zarr_chunk_size } )
+        encoding = zarr_encoding( chunked_dataset )
+        print( f"Writing output to {output_file}, chunk size = {dataManager.zarr_chunk_size}, compressor = {cname}, threads = {dataManager.write_threads}")
+        with dask.config.set( scheduler='threads', num_workers=dataManager.write_threads ):
+            chunked_dataset.to_zarr( output_file, mode='w', encoding=encoding, consolidated=True )
+    else:
+        print( f"Writing output to {output_file}")
+        tmp_file = output_file + ".tmp"
+        # Unlimited samples (and category) dimensions let append_inputs extend the file in place
+        unlimited_dims = [ dim for dim in dataset.dims if dim not in ( 'bands', 'model' ) ]
+        chunk_size = max( 1, min( dataManager.zarr_chunk_size, dataset.sizes['samples'] ) )
+        encoding = { vname: dict( chunksizes=tuple( chunk_size if dim == 'samples' else dataset[vname].sizes[dim] for dim in dataset[vname].dims ) )
+                     for vname in dataset.data_vars if 'samples' in dataset[vname].dims }
+        write = partial( dataset.to_netcdf, tmp_file, format='NETCDF4', engine='netcdf4', unlimited_dims=unlimited_dims, encoding=encoding )
+        if block_size > 0:
+            import dask
+            with dask.config.set( scheduler='synchronous' ): write()
+        else: write()
+        os.replace( tmp_file, output_file )
+    return output_file
+
+def input_file_ids( input_vars ) -> List[str]:
+    pspec = input_vars['plot']
+    return [ input_vars['embedding'] ] + list(input_vars['directory']) + [ pspec[vid] for vid in [ 'x', 'y' ] ]
+
+def convert_inputs( input_vars ) -> Dict[str,Optional[str]]:
+    dataManager = DataManager.instance()
+    return { vid: dataManager.convertInputFile( vid ) for vid in input_file_ids( input_vars ) }
+
+def input_file_paths( input_vars ) -> List[str]:
+    dataManager = DataManager.instance()
+    store_paths = [ ( dataManager.inputStorePath( vid ), dataManager.inputFilePath( vid ) ) for vid in input_file_ids( input_vars ) ]
+    return [ store_path if DataManager.storeIsCurrent( store_path, file_path ) else file_path for ( store_path, file_path ) in store_paths ]
+
+def prepare_inputs( input_vars, ssample = None, block_size = None ):
     dataManager = DataManager.instance()
     subsample = dataManager.subsample if ssample is None else ssample
-    np_embedding = dataManager.getInputFileData( input_vars['embedding'], subsample )
+    bsize = dataManager.block_size if block_size is None else block_size
+    reduction_method = dataManager.config.value("input.reduction/method",  'None')
+    ndim = int(dataManager.config.value("input.reduction/ndim", 32 ))
+    epochs = int(dataManager.config.value("input.reduction/epochs", 1))
+    projId = dataManager.config.value('project/id')
+    file_name = f"raw" if reduction_method.lower() == "none" else f"{reduction_method}-{ndim}"
+    if subsample > 1: file_name = f"{file_name}-ss{subsample}"
+    outputDir = os.path.join( dataManager.config.value('data/cache'), projId )
+    mode = 0o777
+    os.makedirs( outputDir, mode, True )
+    output_base = os.path.join( outputDir, file_name )
+    dataManager.evictDatasetFile( output_base )
+
+    resultCache = ResultCache.instance()
+    cache_key = resultCache.key( input_file_paths( input_vars ), input_vars=input_vars, method=reduction_method, ndim=ndim, epochs=epochs,
+                                 subsample=subsample, block_size=bsize, format=dataManager.dataset_format.lower(), compact=dataManager.compact_dtypes )
+    cached_file = resultCache.get( cache_key, output_base + dataset_extension() )
+    if cached_file is not None: return cached_file
+
+    np_inputs = dataManager.getInputFileData( input_vars['embedding'], subsample )
+    np_embedding = blocked( np_inputs, bsize )
     dims = np_embedding.shape
     mdata_vars = list(input_vars['directory'])
     xcoords = OrderedDict( samples = np.arange( dims[0] ), bands = np.arange(dims[1]) )
-    xdims = OrderedDict( { dims[0]: 'samples', dims[1]: 'bands' } )
     data_vars = dict( embedding = xa.DataArray( np_embedding, dims=xcoords.keys(), coords=xcoords, name=input_vars['embedding'] ) )
-    data_vars.update( { vid: getXarray( vid, xcoords, subsample, xdims ) for vid in mdata_vars } )
     pspec = input_vars['plot']
-    data_vars.update( { f'plot-{vid}': getXarray( pspec[vid], xcoords, subsample, xdims, norm=pspec.get('norm','')) for vid in [ 'x', 'y' ] } )
-    reduction_method = dataManager.config.value("input.reduction/method",  'None')
-    ndim = int(dataManager.config.value("input.reduction/ndim", 32 ))
-    epochs = int(dataManager.config.value("input.reduction/epochs", 1))
-    if reduction_method != "None":
-       reduced_spectra = ReductionManager.instance().reduce( data_vars['embedding'], reduction_method, ndim, epochs )
+    np_data = dataManager.loadInputFiles( mdata_vars + [ pspec['y'] ], subsample )
+    data_vars.update( { vid: wrapXarray( vid, np_data[vid], xcoords, sample_dims( np_data[vid] ), bsize ) for vid in mdata_vars } )
+    data_vars['plot-x'] = wrapXarray( pspec['x'], dataManager.getInputFileData( pspec['x'] ), xcoords, [ 'bands' ], bsize, norm=pspec.get('norm','') )
+    data_vars['plot-y'] = wrapXarray( pspec['y'], np_data[pspec['y']], xcoords, [ 'samples', 'bands' ], bsize, norm=pspec.get('norm','') )
+    data_vars = compact_vars( data_vars )
+    if reduction_method.lower() != "none":
+       if bsize > 0:
+           reduction_file = output_base + ".reduction.npy"
+           reduced_spectra = blocked( ReductionManager.instance().stream_reduction( np_inputs, reduction_method, ndim, epochs, bsize, reduction_file ), bsize )
+       else:
+           reduced_spectra = ReductionManager.instance().reduce( data_vars['embedding'], reduction_method, ndim, epochs )
        coords = dict( samples=xcoords['samples'], model=np.arange(ndim) )
-       data_vars['reduction'] =  xa.DataArray( reduced_spectra, dims=['samples','model'], coords=coords )
+       data_vars['reduction'] =  xa.DataArray( reduced_spectra, dims=['samples','model'], coords=coords, attrs=dict( method=reduction_method ) )
+
+       encoder_file = ReductionManager.instance().save_reducer( f"{output_base}-{cache_key[:16]}.encoder" )
+       if encoder_file is not None: data_vars['reduction'].attrs['encoder'] = os.path.basename( encoder_file )
 
     dataset = xa.Dataset( data_vars, coords=xcoords, attrs = {'type':'spectra'} )
+    if 'reduction' in data_vars:
+        dataset.attrs.update( { f"reduction_{mid}": mval for mid, mval in ReductionManager.instance().reduction_metrics.items() } )
     dataset.attrs["colnames"] = mdata_vars
-    projId = dataManager.config.value('project/id')
-    file_name = f"raw" if reduction_method == "None" else f"{reduction_method}-{ndim}"
-    if subsample > 1: file_name = f"{file_name}-ss{subsample}"
-    outputDir = os.path.join( dataManager.config.value('data/cache'), projId )
-    mode = 0o777
-    os.makedirs( outputDir, mode, True )
-    output_file = os.path.join( outputDir, file_name + ".nc" )
-    print( f"Writing output to {output_file}")
-    dataset.to_netcdf( output_file, format='NETCDF4', engine='netcdf4' )
\ No newline at end of file
+    dataManager.evictDatasetFile( output_base )
+    output_file = write_dataset( dataset, output_base, bsize )
+    if os.path.isfile( output_base + ".reduction.npy" ): os.remove( output_base + ".reduction.npy" )
+    resultCache.put( cache_key, output_file )
+    return output_file
+
+def append_inputs( input_vars, ssample = None ) -> xa.Dataset:
+    dataManager = DataManager.instance()
+    subsample = dataManager.subsample if ssample is None else ssample
+    dsid = dataManager.projectId
+    data_file = dataManager.datasetFile( dsid )
+    project_data: xa.Dataset = dataManager.loadDataset( dsid )
+    nsamples = project_data.sizes['samples']
+    np_embedding = dataManager.getInputFileData( input_vars['embedding'], subsample )
+    dims = np_embedding.shape
+    xcoords = OrderedDict( samples = np.arange( nsamples, nsamples + dims[0] ), bands = project_data.coords['bands'].values )
+    data_vars = dict( embedding = xa.DataArray( np_embedding, dims=xcoords.keys(), coords=xcoords, name=input_vars['embedding'] ) )
+    mdata_vars = list(input_vars['directory'])
+    pspec = input_vars['plot']
+    np_data = dataManager.loadInputFiles( mdata_vars + [ pspec['y'] ], subsample )
+    data_vars.update( { vid: wrapXarray( vid, np_data[vid], xcoords, sample_dims( np_data[vid] ) ) for vid in mdata_vars } )
+    data_vars['plot-y'] = wrapXarray( pspec['y'], np_data[pspec['y']], xcoords, [ 'samples', 'bands' ], norm=pspec.get('norm','') )
+    data_vars = compact_vars( data_vars, project_data )
+    if 'reduction' in project_data:
+        reduction = project_data['reduction']
+        encoder_file = os.path.join( os.path.dirname( data_file ), reduction.attrs['encoder'] )
+        reducer = ReductionManager.instance().load_reducer( encoder_file, reduction.attrs.get( 'method', None ), reduction.shape[1] )
+        coords = dict( samples=xcoords['samples'], model=reduction.coords['model'].values )
+        data_vars['reduction'] = xa.DataArray( reducer.transform( np_embedding ), dims=['samples','model'], coords=coords, attrs=reduction.attrs )
+    category_vars = { vid: xvar for vid, xvar in data_vars.items() if 'samples' not in xvar.dims }
+    new_data = xa.Dataset( { vid: xvar for vid, xvar in data_vars.items() if vid not in category_vars }, coords=dict( samples=xcoords['samples'] ) )
+
+    print( f"Appending {dims[0]} samples to dataset {dsid} ({nsamples} samples) in {data_file}")
+    if data_file.endswith( ".zarr" ):
+        new_data.to_zarr( data_file, append_dim='samples', consolidated=True )
+        for catid, categories in category_vars.items():
+            if (catid in project_data) and (project_data[catid].size == categories.size): continue
+            shutil.rmtree( os.path.join( data_file, catid ), ignore_errors=True )
+            xa.Dataset( { catid: categories } ).to_zarr( data_file, mode='a', consolidated=True )
+        dataManager.evictDataset( dsid )
+    else:
+        dataManager.evictDataset( dsid )
+        append_netcdf( data_file, new_data, category_vars )
+    return new_data
+
+def append_netcdf( data_file: str, new_data: xa.Dataset, category_vars: Dict[str,xa.DataArray] ):
+    import netCDF4
+    if os.stat( data_file ).st_nlink > 1:
+        # The file is hard linked to a result cache entry, which must not see the appended samples
+        tmp_file = data_file + ".tmp"
+        shutil.copy2( data_file, tmp_file )
+        os.replace( tmp_file, data_file )
+    with netCDF4.Dataset( data_file, 'a' ) as nc:
+        if not nc.dimensions['samples'].isunlimited():
+            raise ValueError( f"Dataset {data_file} has a fixed samples dimension and can't be appended in place, rerun prepare_inputs to rewrite it or use dataset_format='zarr'" )
+        start = nc.dimensions['samples'].size
+        stop = start + new_data.sizes['samples']
+        for vid in [ 'samples' ] + list( new_data.data_vars ):
+            xvar = new_data[vid]
+            index = tuple( slice( start, stop ) if dim == 'samples' else slice( None ) for dim in xvar.dims )
+            nc.variables[vid][index] = xvar.values.astype( object ) if xvar.dtype.kind == 'U' else xvar.values
+        for catid, categories in category_vars.items():
+            ncvar = nc.variables[catid]
+            ncategories = ncvar.shape[0]
+            if categories.size > ncategories:
+                ncvar[ ncategories: categories.size ] = categories.values[ ncategories: ].astype( object )
@@ -1,7 +1,9 @@
 import numpy as np
 from typing import List, Union, Tuple, Optional, Dict
-import os, math, pickle
+import os, math, pickle, threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import xarray as xa
+import pandas as pd
 import traitlets as tl
 import traitlets.config as tlc
 from astrolab.model.base import AstroSingleton
@@ -10,45 +12,183 @@ class DataManager(tlc.SingletonConfigurable,AstroSingleton):
     reduce_method = tl.Unicode("Autoencoder").tag(config=True)
     cache_dir = tl.Unicode("~/Development/Cache").tag(config=True)
     data_dir = tl.Unicode("~/Development/Cache").tag(config=True)
+    input_store_dir = tl.Unicode("").tag(config=True)
     project_name = tl.Unicode("astrolab").tag(config=True)
     model_dims = tl.Int(16).tag(config=True)
     subsample = tl.Int( 5 ).tag(config=True)
+    block_size = tl.Int( 0 ).tag(config=True)
+    dataset_format = tl.Unicode( "netcdf" ).tag(config=True)
+    zarr_chunk_size = tl.Int( 10000 ).tag(config=True)
+    zarr_compressor = tl.Unicode( "zstd" ).tag(config=True)
+    zarr_compression_level = tl.Int( 3 ).tag(config=True)
+    write_threads = tl.Int( 4 ).tag(config=True)
+    load_workers = tl.Int( 8 ).tag(config=True)
+    load_pool = tl.Unicode( "thread" ).tag(config=True)
+    chunk_size = tl.Int( 100000 ).tag(config=True)
+    compact_dtypes = tl.Bool( True ).tag(config=True)
 
     def __init__(self, **kwargs):
         super(DataManager, self).__init__(**kwargs)
+        self._datasets: Dict[Tuple[str,bool],Tuple[xa.Dataset,Tuple[float,int]]] = {}
+        self._datasets_lock = threading.Lock()
 
     def getInputFileData(self, input_file_id: str, subsample: int = 1, dims: Tuple[int] = None ):
-        input_file_path = os.path.join( self.data_dir, f"{input_file_id}.pkl")
+        return self.readInputFile( input_file_id, self.inputStorePath( input_file_id ), self.inputFilePath( input_file_id ), subsample, dims )
+
+    @classmethod
+    def readInputFile(cls, input_file_id: str, store_file_path: str, input_file_path: str, subsample: int = 1, dims: Tuple[int] = None ):
         try:
-            if os.path.isfile(input_file_path):
+            if os.path.isfile( store_file_path ) and not cls.storeIsCurrent( store_file_path, input_file_path ):
+                print(f"Input store {store_file_path} is older than {input_file_path}, reconverting")
+                cls.convertFile( input_file_id, input_file_path, store_file_path )
+            if cls.storeIsCurrent( store_file_path, input_file_path ):
+                print(f"Mapping {input_file_id} data from input store {store_file_path}")
+                return cls.subsampleInput( np.load( store_file_path, mmap_mode='r' ), subsample, dims )
+            elif os.path.isfile(input_file_path):
                 print(f"Reading unstructured {input_file_id} data from file {input_file_path}")
                 with open(input_file_path, 'rb') as f:
-                    result = pickle.load(f)
-                    if   isinstance( result, np.ndarray ):
-                        if dims is not None and (result.shape[0] == dims[1]) and result.ndim == 1: return result
-                        return result[::subsample]
-                    elif isinstance( result, list ):
-                        if dims is not None and ( len(result) == dims[1] ): return result
-                        subsampled = [ result[i] for i in range( 0, len(result), subsample ) ]
-                        if isinstance( result[0], np.ndarray ):  return np.vstack( subsampled )
-                        else:                                    return np.array( subsampled )
+                    return cls.subsampleInput( pickle.load(f), subsample, dims )
             else:
                 print( f"Error, the input path '{input_file_path}' is not a file.")
         except Exception as err:
             print(f" Can't read data[{input_file_id}] file {input_file_path}: {err}")
 
+    @classmethod
+    def subsampleInput(cls, result: Union[np.ndarray,List], subsample: int = 1, dims: Tuple[int] = None ):
+        if   isinstance( result, np.ndarray ):
+            if dims is not None and (result.shape[0] == dims[1]) and result.ndim == 1: return result
+            return result[::subsample]
+        elif isinstance( result, list ):
+            if dims is not None and ( len(result) == dims[1] ): return result
+            subsampled = [ result[i] for i in range( 0, len(result), subsample ) ]
+            if isinstance( result[0], np.ndarray ):  return np.vstack( subsampled )
+            else:                                    return np.array( subsampled )
+
+    def loadInputFiles(self, input_file_ids: List[str], subsample: int = 1, dims: Tuple[int] = None ) -> Dict[str,np.ndarray]:
+        if self.load_workers <= 1:
+            return { vid: self.getInputFileData( vid, subsample, dims ) for vid in input_file_ids }
+        Executor = ProcessPoolExecutor if self.load_pool.lower() == "process" else ThreadPoolExecutor
+        print(f"Loading {len(input_file_ids)} input files with {self.load_workers} {self.load_pool} workers")
+        with Executor( max_workers=self.load_workers ) as executor:
+            futures = { vid: executor.submit( DataManager.readInputFile, vid, self.inputStorePath( vid ), self.inputFilePath( vid ), subsample, dims ) for vid in input_file_ids }
+            return { vid: future.result() for vid, future in futures.items() }
+
+    def inputFilePath(self, input_file_id: str ) -> str:
+        return os.path.join( self.data_dir, f"{input_file_id}.pkl")
+
+    def inputStorePath(self, input_file_id: str ) -> str:
+        return os.path.join( self.inputStoreDir, f"{input_file_id}.npy" )
+
+    @classmethod
+    def storeIsCurrent(cls, store_file_path: str, input_file_path: str ) -> bool:
+        if not os.path.isfile( store_file_path ): return False
+        if not os.path.isfile( input_file_path ): return True
+        return os.path.getmtime( store_file_path ) >= os.path.getmtime( input_file_path )
+
+    def convertInputFile(self, input_file_id: str ) -> Optional[str]:
+        return self.convertFile( input_file_id, self.inputFilePath( input_file_id ), self.inputStorePath( input_file_id ) )
+
+    @classmethod
+    def convertFile(cls, input_file_id: str, input_file_path: str, store_file_path: str ) -> Optional[str]:
+        try:
+            with open(input_file_path, 'rb') as f:
+                result = pickle.load(f)
+            if isinstance( result, list ):
+                result = np.vstack( result ) if isinstance( result[0], np.ndarray ) else np.array( result )
+            if result.dtype == object:
+                print( f"Error, data[{input_file_id}] has no fixed width dtype and can't be memory-mapped, keeping {input_file_path}")
+                return None
+            tmp_file_path = store_file_path + ".tmp.npy"
+            np.save( tmp_file_path, result, allow_pickle=False )
+            os.replace( tmp_file_path, store_file_path )
+            print(f"Converted {input_file_id} data {result.shape} from {input_file_path} to input store {store_file_path}")
+            return store_file_path
+        except Exception as err:
+            print(f" Can't convert data[{input_file_id}] file {input_file_path}: {err}")
+
     def loadDataset( self, dsid: str, *args, **kwargs ) -> xa.Dataset:
-        data_file = os.path.join( self.datasetDir, dsid + ".nc" )
-        dataset: xa.Dataset = xa.open_dataset( data_file )
-        print( f"Opened Dataset {dsid} from file {data_file}")
-        dataset.attrs['dsid'] = dsid
-        dataset.attrs['type'] = 'spectra'
+        lazy = kwargs.get( 'lazy', False )
+        data_file = self.datasetFile( dsid )
+        signature = self.fileSignature( data_file )
+        with self._datasets_lock:
+            cached = self._datasets.get( ( dsid, lazy ) )
+            if cached is not None:
+                if cached[1] == signature: return cached[0]
+                print( f"Dataset {dsid} changed on disk, reopening file {data_file}")
+                cached[0].close()
+            engine = "zarr" if data_file.endswith(".zarr") else None
+            chunks = { 'samples': self.chunk_size } if lazy else None
+            dataset: xa.Dataset = xa.open_dataset( data_file, engine=engine, chunks=chunks )
+            print( f"Opened {'lazy ' if lazy else ''}Dataset {dsid} from file {data_file}")
+            dataset.attrs['dsid'] = dsid
+            dataset.attrs['type'] = 'spectra'
+            self._datasets[ ( dsid, lazy ) ] = ( dataset, signature )
         return dataset
 
-    def loadCurrentProject(self) -> xa.Dataset:
+    def evictDataset( self, dsid: str = None ):
+        with self._datasets_lock:
+            keys = [ key for key in self._datasets.keys() if ( dsid is None ) or ( key[0] == dsid ) ]
+            for key in keys:
+                cached = self._datasets.pop( key )
+                cached[0].close()
 
-        projId = f"{self.reduce_method}-{self.model_dims}-ss{self.subsample}"
-        return self.loadDataset( projId )
+    def evictDatasetFile( self, file_base: str ):
+        with self._datasets_lock:
+            keys = [ key for key in self._datasets.keys() if os.path.splitext( os.path.realpath( self.datasetFile( key[0] ) ) )[0] == os.path.realpath( file_base ) ]
+            for key in keys:
+                cached = self._datasets.pop( key )
+                cached[0].close()
+
+    def datasetFile( self, dsid: str ) -> str:
+        zarr_file = os.path.join( self.datasetDir, dsid + ".zarr" )
+        nc_file = os.path.join( self.datasetDir, dsid + ".nc" )
+        if os.path.isdir( zarr_file ) and os.path.isfile( nc_file ):
+            return zarr_file if self.fileSignature( zarr_file )[0] >= self.fileSignature( nc_file )[0] else nc_file
+        if os.path.isdir( zarr_file ): return zarr_file
+        if os.path.isfile( nc_file ):  return nc_file
+        return zarr_file if self.dataset_format.lower() == "zarr" else nc_file
+
+    @classmethod
+    def fileSignature( cls, file_path: str ) -> Tuple[float,int]:
+        # Consolidated zarr metadata ( .zmetadata in zarr 2, zarr.json in zarr 3 ) is rewritten by every write to the store
+        zmetadata = [ os.path.join( file_path, name ) for name in ( ".zmetadata", "zarr.json" ) if os.path.isfile( os.path.join( file_path, name ) ) ]
+        fstat = os.stat( zmetadata[0] if zmetadata else file_path )
+        return ( fstat.st_mtime, fstat.st_size )
+
+    @property
+    def projectId(self) -> str:
+        return f"{self.reduce_method}-{self.model_dims}-ss{self.subsample}"
+
+    def loadCurrentProject( self, vars: List[str] = None, lazy: bool = False ) -> xa.Dataset:
+        dataset = self.loadDataset( self.projectId, lazy=lazy )
+        return dataset if vars is None else dataset[ vars ]
+
+    def getProjectData( self, vars: List[str], samples = None ) -> xa.Dataset:
+        project_data: xa.Dataset = self.loadCurrentProject( vars, lazy=True )
+        if samples is not None: project_data = project_data.isel( samples=samples )
+        return project_data.compute()
+
+    @classmethod
+    def getCategories( cls, project_data: xa.Dataset, vid: str ) -> Optional[np.ndarray]:
+        catid = project_data[vid].attrs.get( 'categories', None )
+        return None if catid is None else project_data[catid].values
+
+    def getCatalog( self, cols: List[str], samples = None ) -> Dict[str,Union[np.ndarray,pd.Categorical]]:
+        project_data: xa.Dataset = self.loadCurrentProject( lazy=True )
+        catids = [ project_data[col].attrs['categories'] for col in cols if 'categories' in project_data[col].attrs ]
+        catalog_data: xa.Dataset = self.getProjectData( cols + catids, samples )
+        catalog = {}
+        for col in cols:
+            categories = self.getCategories( catalog_data, col )
+            if categories is None: catalog[col] = catalog_data[col].values
+            else:                  catalog[col] = pd.Categorical.from_codes( catalog_data[col].values, categories )
+        return catalog
+
+    @property
+    def inputStoreDir(self):
+        isdir = self.input_store_dir if self.input_store_dir else os.path.join( self.datasetDir, "inputs" )
+        os.makedirs( isdir, exist_ok=True )
+        return isdir
 
     @property
     def datasetDir(self):
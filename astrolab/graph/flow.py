@@ -1,15 +1,16 @@
-from pynndescent import NNDescent
 import numpy as np
 import numpy.ma as ma
 import xarray as xa
 import numba
-from typing import List, Union, Tuple, Optional, Dict
+from typing import List, Union, Tuple, Optional, Dict, TYPE_CHECKING
 import os, time, threading, traceback
 import traitlets.config as tlc
 import traitlets as tl
 from astrolab.model.base import AstroSingleton
+if TYPE_CHECKING:
+    from pynndescent import NNDescent
 
-@numba.njit(fastmath=True,
+@numba.njit(fastmath=True, cache=True,
     locals={
         "selection": numba.boolean[:],
         "indices": numba.int32[:],
@@ -22,7 +23,7 @@ def getFilteredLabels( labels: np.ndarray ) -> np.ndarray:
     index_stack = np.vstack( (indices, labels) ).transpose()
     return index_stack[ selection ]
 
-@numba.jit(fastmath=True,
+@numba.jit(fastmath=True, cache=True,
     locals={
         "iN": numba.int32,
         "pid": numba.int32,
@@ -91,7 +92,7 @@ class ActivationFlow(object):
     def __init__(self, nodes_data: xa.DataArray, n_neighbors: int, **kwargs ):
         self.nneighbors = n_neighbors
         self.nodes: xa.DataArray = None
-        self.nnd: NNDescent = None
+        self.nnd: "NNDescent" = None
         self.I: np.ndarray = None
         self.D: np.ndarray = None
         self.P: np.ndarray = None
@@ -126,8 +127,24 @@ class ActivationFlow(object):
             else:
                 print( "No data available for this block")
 
+    def appendNodeData(self, nodes_data: xa.DataArray, **kwargs ):
+        t0 = time.time()
+        nnew = nodes_data.shape[0]
+        self.nodes = xa.concat( [ self.nodes, nodes_data ], dim=self.nodes.dims[0] )
+        if hasattr( self.nnd, "update" ):
+            self.nnd.update( nodes_data.values )
+        else:
+            self.nnd = self.getNNGraph( self.nodes, self.nneighbors, **kwargs )
+        self.I = self.nnd.neighbor_graph[0]
+        self.D = self.nnd.neighbor_graph[1]
+        if self.C is not None: self.C = np.concatenate( [ self.C, np.zeros( nnew, dtype=self.C.dtype ) ] )
+        if self.P is not None: self.P = np.concatenate( [ self.P, np.full( nnew, float('inf'), dtype=self.P.dtype ) ] )
+        dt = (time.time()-t0)
+        print( f"Appended {nnew} verts to NN Graph, now {self.nodes.shape[0]} verts, in {dt} sec ({dt/60} min)")
+
     @classmethod
     def getNNGraph(cls, nodes: xa.DataArray, n_neighbors: int, **kwargs ):
+        from pynndescent import NNDescent
         n_trees = kwargs.get('ntree', 5 + int(round((nodes.shape[0]) ** 0.5 / 20.0)))
         n_iters = kwargs.get('niter', max(5, 2 * int(round(np.log2(nodes.shape[0])))))
         nnd = NNDescent(nodes.values, n_trees=n_trees, n_iters=n_iters, n_neighbors=n_neighbors, max_candidates=60, verbose=True)
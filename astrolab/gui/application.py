@@ -78,6 +78,21 @@ class Astrolab( tlc.SingletonConfigurable, AstroSingleton ):
         if embed: ActionsPanel.instance().embed()
         return gui
 
+    def append( self, input_vars: Dict, ssample: int = None ):
+        from astrolab.data.inputs import append_inputs
+        from astrolab.data.manager import DataManager
+        from astrolab.gui.points import PointCloudManager
+        from astrolab.gui.table import TableManager
+        from astrolab.gui.graph import GraphManager, JbkGraph
+        new_data = append_inputs( input_vars, ssample )
+        if GraphManager.initialized():
+            JbkGraph.init_data( mdata=self.table_cols, reload=True )
+        if TableManager.initialized():
+            TableManager.instance().append_rows( DataManager.instance().getCatalog( self.table_cols, new_data.samples.values ) )
+        if PointCloudManager.initialized() and ( 'reduction' in new_data ):
+            PointCloudManager.instance().append_data( new_data['reduction'] )
+        return new_data
+
     def __delete__(self, instance):
         self.save_config()
 
@@ -1,13 +1,8 @@
-from bokeh.plotting import figure
-from bokeh.io import output_notebook
-import jupyter_bokeh as jbk
-from bokeh.transform import linear_cmap
 import ipywidgets as ip
 from typing import List, Union, Tuple, Optional, Dict, Callable
 import xarray as xa
 import numpy as np
 from astrolab.data.manager import DataManager
-from bokeh.models import ColumnDataSource
 import ipywidgets as widgets
 import traitlets.config as tlc
 from astrolab.model.base import AstroSingleton
@@ -15,8 +10,13 @@ from astrolab.model.base import AstroSingleton
 class JbkGraph:
 
     def __init__( self, **kwargs ):
+        from bokeh.plotting import figure
+        from bokeh.transform import linear_cmap
+        from bokeh.models import ColumnDataSource
+        import jupyter_bokeh as jbk
         self.init_data(**kwargs)
         self._selected_pids: List[int] = [0]
+        self._ydata: np.ndarray = None
         self._source = ColumnDataSource(data=dict(
             xs=self.x,  # x coords for each line (list of lists)
             ys=self.y,  # y coords for each line (list of lists)
@@ -33,14 +33,20 @@ class JbkGraph:
 
     @classmethod
     def init_data(cls, **kwargs ):
-        if not hasattr(cls, '_x'):
-            project_data: xa.Dataset = DataManager.instance().loadCurrentProject()
+        if kwargs.get( 'reload', False ) or not hasattr(cls, '_x'):
+            project_data: xa.Dataset = DataManager.instance().loadCurrentProject( lazy=True )
             cls._x: np.ndarray = project_data["plot-x"].values
-            cls._ploty: np.ndarray = project_data["plot-y"].values
-            cls._mdata: List[np.ndarray] = [ project_data[mdv].values for mdv in kwargs.get("mdata", []) ]
+            cls._ploty: xa.DataArray = project_data["plot-y"]
+            cls._mdata: List[Tuple[xa.DataArray,Optional[np.ndarray]]] = [ ( project_data[mdv], DataManager.getCategories( project_data, mdv ) ) for mdv in kwargs.get("mdata", []) ]
 
     def select_items(self, idxs: List[int] ):
         self._selected_pids = idxs
+        self._ydata = None
+
+    @property
+    def ydata(self) -> np.ndarray:
+        if self._ydata is None: self._ydata = self._ploty[ self._selected_pids ].values
+        return self._ydata
 
     def plot(self):
         y, yr = self.y, self.yrange
@@ -56,17 +62,18 @@ class JbkGraph:
 
     @property
     def y( self ) -> List[ np.ndarray ]:
-        return [ self._ploty[idx].squeeze() for idx in self._selected_pids ]
+        return [ yrow.squeeze() for yrow in self.ydata ]
 
     @property
     def yrange(self):
-        ydata = self._ploty[ self._selected_pids ]
+        ydata = self.ydata
         return ( ydata.min(), ydata.max() )
 
     @property
     def title(self ) -> str:
         if len(self._selected_pids) == 1:
-            t = ' '.join([str(mdarray[self._selected_pids[0]]) for mdarray in self._mdata])
+            values = [ ( mdarray[self._selected_pids[0]].values, categories ) for ( mdarray, categories ) in self._mdata ]
+            t = ' '.join([ str( value if categories is None else categories[value] ) for ( value, categories ) in values ])
         else:
             t = "multiplot"
         return t
@@ -75,6 +82,7 @@ class GraphManager(tlc.SingletonConfigurable,AstroSingleton):
 
     def __init__( self, **kwargs ):
         super(GraphManager, self).__init__( **kwargs )
+        from bokeh.io import output_notebook
         output_notebook()
         self._wGui: widgets.Tab() = None
         self._graphs: List[JbkGraph] = []
@@ -1,27 +1,34 @@
-import time, math, numpy as np
+import time, math, threading, numpy as np
+from functools import partial
 from astrolab.data.manager import DataManager
 from astrolab.reduction.embedding import ReductionManager
-from typing import List, Union, Tuple, Optional, Dict, Callable
+from typing import List, Union, Tuple, Optional, Dict, Callable, TYPE_CHECKING
 from matplotlib import cm
-from itkwidgets import view
-from itkwidgets.widget_viewer import Viewer
 import xarray as xa
 import numpy.ma as ma
 import traitlets.config as tlc
+import traitlets as tl
 from astrolab.model.base import AstroSingleton, Marker
 from astrolab.model.labels import LabelsManager
+if TYPE_CHECKING:
+    from itkwidgets.widget_viewer import Viewer
 
 class PointCloudManager(tlc.SingletonConfigurable,AstroSingleton):
+    plot_rate = tl.Float( 2.0 ).tag(config=True)
 
     def __init__(self, **kwargs):
         super(PointCloudManager, self).__init__(**kwargs)
-        self._gui: Viewer = None
+        self._gui: "Viewer" = None
         self._n_point_bins = 27
         self._embedding: np.ndarray = None
         self._marker_points: List[np.ndarray] = [ self.empty_pointset for ic in range( LabelsManager.instance().nLabels ) ]
         self._marker_pids: List[np.ndarray] = [ self.empty_pids for ic in range( LabelsManager.instance().nLabels ) ]
         self._binned_points: List[np.ndarray] = [self.empty_pointset for ic in range(self._n_point_bins)]
         self._points: np.ndarray = self.empty_pointset
+        self._frame: np.ndarray = None
+        self._frame_lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._plot_thread: threading.Thread = None
 
     @property
     def empty_pointset(self) -> np.ndarray:
@@ -36,22 +43,67 @@ class PointCloudManager(tlc.SingletonConfigurable,AstroSingleton):
     def empty_pids(self) -> np.ndarray:
         return np.empty(shape=[0], dtype=np.int)
 
+    @classmethod
+    def tag_dataset( cls, reduced_data: xa.DataArray ) -> xa.DataArray:
+        # The project dataset is cached and shared by DataManager.loadDataset, so the dsid goes on a shallow copy
+        tagged_data = reduced_data.copy( deep=False )
+        tagged_data.attrs = { **reduced_data.attrs, 'dsid': 'swift' }
+        return tagged_data
+
     def init_data( self, **kwargs  ):
         project_dataset = DataManager.instance().loadCurrentProject()
-        reduced_data: xa.DataArray = project_dataset.reduction
-        reduced_data.attrs['dsid'] = 'swift'
+        reduced_data: xa.DataArray = self.tag_dataset( project_dataset.reduction )
         self._embedding = ReductionManager.instance().umap_init( reduced_data, **kwargs  )
 
-    def reembed(self, **kwargs ):
+    def reembed(self, background: bool = False, **kwargs ):
         t0 = time.time()
+        kwargs.setdefault( 'progress_callback', self.plot_progress )
+        kwargs.setdefault( 'frame_rate', self.plot_rate )
+        if background:
+            kwargs.setdefault( 'on_complete', partial( self.on_embedding_complete, t0 ) )
+            task = ReductionManager.instance().umap_embedding_task( **kwargs )
+            self._embedding = task.layout.head_embedding
+            return task
         self._embedding = ReductionManager.instance().umap_embedding( **kwargs )
         self.update_plot()
         print(f"PointCloudManager: completed embed in {time.time()-t0} sec")
 
+    def on_embedding_complete(self, t0: float, embedding: np.ndarray ):
+        self._embedding = embedding
+        print(f"PointCloudManager: completed background embed in {time.time()-t0} sec")
+
+    def append_data( self, reduced_data: xa.DataArray ):
+        self._embedding = ReductionManager.instance().umap_append( self.tag_dataset( reduced_data ) )
+        self.update_plot()
+
     def update_plot( self, **kwargs ):
         self._points = kwargs.get( 'points', self._embedding )
         self._gui.point_sets = self.point_sets
 
+    def plot_progress( self, epoch: int, points: np.ndarray ):
+        with self._frame_lock:
+            self._frame = points
+            self._frame_ready.set()
+            if self._plot_thread is None:
+                self._plot_thread = threading.Thread( target=self._plot_frames, daemon=True )
+                self._plot_thread.start()
+
+    def _plot_frames( self ):
+        while True:
+            self._frame_ready.wait( 5.0 )
+            with self._frame_lock:
+                points, self._frame = self._frame, None
+                self._frame_ready.clear()
+                if points is None:
+                    self._plot_thread = None
+                    return
+            t0 = time.time()
+            try:
+                if self._gui is not None: self.update_plot( points=points )
+            except Exception as err:
+                print( f"PointCloudManager: error updating plot: {err}")
+            if self.plot_rate > 0: time.sleep( max( 0.0, 1.0/self.plot_rate - (time.time()-t0) ) )
+
     def on_selection(self, selection_event: Dict ):
         selection = selection_event['pids']
         self.update_markers(selection)
@@ -122,6 +174,7 @@ class PointCloudManager(tlc.SingletonConfigurable,AstroSingleton):
             bin_colors = self.get_bin_colors("gist_rainbow") # self.get_bin_colors("jet",True)
             ptcolors = [ [1.0, 1.0, 1.0, 1.0], ] + bin_colors + LabelsManager.instance().colors[::-1]
             ptsizes = [1]*(self._n_point_bins+1) + [8]*LabelsManager.instance().nLabels
+            from itkwidgets import view
             self._gui = view( point_sets = self.point_sets, point_set_sizes=ptsizes, point_set_colors=ptcolors, background=[0,0,0] )
             self._gui.layout = { 'width': 'auto', 'flex': '1 1 auto' }
         return self._gui
@@ -34,15 +34,27 @@ class TableManager(tlc.SingletonConfigurable,AstroSingleton):
 
     def init(self, **kwargs):
         catalog: Dict[str,np.ndarray] = kwargs.get( 'catalog', None )
-        project_data: xa.Dataset = DataManager.instance().loadCurrentProject()
-        table_cols = kwargs.get('cols', project_data.variables.keys())
-        if catalog is None:  catalog = { tcol: project_data[tcol].values for tcol in table_cols }
-        nrows = catalog[table_cols[0]].shape[0]
-        self._dataFrame: pd.DataFrame = pd.DataFrame( catalog, dtype='U', index=pd.Int64Index( range(nrows), name="Index" ) )
+        dataManager = DataManager.instance()
+        table_cols = kwargs.get( 'cols', None )
+        if table_cols is None: table_cols = np.atleast_1d( dataManager.loadCurrentProject( lazy=True ).attrs['colnames'] ).tolist()
+        if catalog is None:  catalog = dataManager.getCatalog( table_cols )
+        nrows = len( catalog[table_cols[0]] )
+        self._dataFrame: pd.DataFrame = pd.DataFrame( catalog, index=pd.Int64Index( range(nrows), name="Index" ) )
         self._cols = list(catalog.keys()) + [ "Class" ]
         self._class_map = np.zeros( nrows, np.int32 )
         self._flow_class_map = np.zeros(nrows, np.int32)
 
+    def append_rows(self, catalog: Dict[str,np.ndarray] ):
+        nrows0 = self._dataFrame.shape[0]
+        nnew = len( catalog[ self._cols[0] ] )
+        new_rows = pd.DataFrame( { col: catalog[col] for col in self._cols[:-1] }, index=pd.Int64Index( range( nrows0, nrows0 + nnew ), name="Index" ) )
+        self._dataFrame = pd.concat( [ self._dataFrame, new_rows ] )
+        self._class_map = np.concatenate( [ self._class_map, np.zeros( nnew, np.int32 ) ] )
+        self._flow_class_map = np.concatenate( [ self._flow_class_map, np.zeros( nnew, np.int32 ) ] )
+        if len( self._tables ) > 0:
+            new_rows.insert( len(self._cols)-1, "Class", 0, True )
+            self._tables[0].df = pd.concat( [ self._tables[0].df, new_rows ] )
+
     def add_selection_listerner( self, listener: Callable[[Dict],None] ):
         self._selection_listeners.append( listener )
 
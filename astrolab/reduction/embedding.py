@@ -1,16 +1,24 @@
 from typing import List, Union, Tuple, Dict
-from keras.layers import *
-from keras.models import *
-from typing import List, Union, Tuple, Optional, Dict
+from typing import List, Union, Tuple, Optional, Dict, Callable, Iterator, TYPE_CHECKING
 from ..data.manager import DataManager
 from ..graph.flow import ActivationFlowManager
+from .reducers import Reducer, get_reducer, measure_reduction
 import xarray as xa
-import numpy as np, time, traceback
-from .umap import UMAP
+import numpy as np, time, traceback, os, math, json, shutil, hashlib
 from ..model.labels import LabelsManager
 import traitlets as tl
 import traitlets.config as tlc
 from astrolab.model.base import AstroSingleton
+if TYPE_CHECKING:
+    from keras.models import Model
+    from .umap import UMAP, LayoutTask
+
+def array_fingerprint( data: np.ndarray, block_rows: int = 100000 ) -> str:
+    hasher = hashlib.blake2b( digest_size=20 )
+    hasher.update( f"{data.shape}:{data.dtype}".encode() )
+    for iR in range( 0, data.shape[0], block_rows ):
+        hasher.update( np.ascontiguousarray( data[iR:iR+block_rows] ).tobytes() )
+    return hasher.hexdigest()
 
 class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
     init = tl.Unicode("random").tag(config=True)
@@ -18,6 +26,19 @@ class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
     alpha = tl.Float( 0.25 ).tag(config=True)
     ndim = tl.Int( 3 ).tag(config=True)
     target_weight = tl.Float( 0.5 ).tag(config=True)
+    encoder_cache = tl.Bool( True ).tag(config=True)
+    pca_block_size = tl.Int( 10000 ).tag(config=True)
+    trace_memory = tl.Bool( False ).tag(config=True)
+    patience = tl.Int( 0 ).tag(config=True)
+    min_delta = tl.Float( 1e-4 ).tag(config=True)
+    checkpoint_period = tl.Int( 5 ).tag(config=True)
+    deterministic = tl.Bool( False ).tag(config=True)
+    seed = tl.Int( -1 ).tag(config=True)
+    vertex_order = tl.Unicode("none").tag(config=True)
+    transform_batch_size = tl.Int( 10000 ).tag(config=True)
+    landmarks = tl.Int( 0 ).tag(config=True)
+    refine_epochs = tl.Int( 20 ).tag(config=True)
+    repulsion = tl.Unicode("sampling").tag(config=True)
 
     UNDEF = -1
     INIT = 0
@@ -32,17 +53,65 @@ class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
         self.ndim = 3
         self._state = self.UNDEF
         self._samples_coord = None
+        self._encoder: "Model" = None
+        self._reducer: Reducer = None
+        self.reduction_metrics: Dict = {}
+        self._embedding_task: "LayoutTask" = None
+
+    def getReducer( self, reduction_method: str, ndim: int ) -> Reducer:
+        return get_reducer( reduction_method, ndim, block_size=self.pca_block_size )
+
+    def fit_reducer( self, inputs: np.ndarray, reduction_method: str, ndim: int, nepochs: int = 1, block_size: int = 0 ) -> Reducer:
+        reducer = self.getReducer( reduction_method, ndim )
+        if block_size > 0:  self._reducer = reducer.fit_blocks( inputs, block_size, nepochs=nepochs )
+        else:               self._reducer = reducer.fit( inputs, nepochs=nepochs )
+        return self._reducer
 
     def reduce(self, inputs: np.ndarray, reduction_method: str, ndim: int, nepochs: int = 1  ) -> np.ndarray:
-        if reduction_method.lower() == "autoencoder": return self.autoencoder_reduction( inputs, ndim, nepochs )
+        self.reduction_metrics = dict( method=reduction_method )
+        with measure_reduction( self.reduction_metrics, self.trace_memory ):
+            reduced = self.fit_reducer( inputs, reduction_method, ndim, nepochs ).transform( inputs )
+        self.reduction_metrics['output_size'] = reduced.nbytes
+        self.print_metrics()
+        return reduced
+
+    def stream_reduction(self, inputs: np.ndarray, reduction_method: str, ndim: int, nepochs: int, block_size: int, output_file: str ) -> np.ndarray:
+        self.reduction_metrics = dict( method=reduction_method )
+        with measure_reduction( self.reduction_metrics, self.trace_memory ):
+            reducer = self.fit_reducer( inputs, reduction_method, ndim, nepochs, block_size )
+            reduced = self.predict_blocks( reducer.transform, inputs, reducer.output_dims( inputs.shape[1] ), block_size, output_file )
+        self.reduction_metrics['output_size'] = reduced.nbytes
+        self.print_metrics()
+        return reduced
+
+    def get_reduction(self, training_data: np.ndarray, reduction_method: str, ndim: int, nepochs: int = 1 ) -> Callable[[np.ndarray],np.ndarray]:
+        self.reduction_metrics = dict( method=reduction_method )
+        with measure_reduction( self.reduction_metrics, self.trace_memory ):
+            reducer = self.fit_reducer( training_data, reduction_method, ndim, nepochs )
+        return reducer.transform
 
     def xreduce(self, inputs: xa.DataArray, reduction_method: str, ndim: int ) -> xa.DataArray:
-        if reduction_method.lower() == "autoencoder":
-            encoded_data = self.autoencoder_reduction( inputs.values, ndim )
+        if reduction_method.lower() != "none":
+            encoded_data = self.reduce( inputs.values, reduction_method, ndim )
             coords = {inputs.dims[0]: inputs.coords[inputs.dims[0]], inputs.dims[1]: np.arange(ndim)}
             return xa.DataArray(encoded_data, dims=inputs.dims, coords=coords, attrs=inputs.attrs)
         return inputs
 
+    def print_metrics(self):
+        metrics = self.reduction_metrics
+        peak_memory = f"{metrics['peak_memory']/2**20:.1f} MB" if 'peak_memory' in metrics else "untraced"
+        print( f"Reduction[{metrics['method']}]: wall time = {metrics['wall_time']:.2f} sec, python peak memory = {peak_memory}, "
+               f"process max rss = {metrics['process_max_rss']/2**20:.1f} MB (+{metrics['max_rss_growth']/2**20:.1f} MB during reduction), "
+               f"output size = {metrics.get('output_size',0)/2**20:.1f} MB")
+
+    def save_reducer( self, file_base: str ) -> Optional[str]:
+        return None if self._reducer is None else self._reducer.save( file_base )
+
+    def load_reducer( self, reducer_file: str, reduction_method: str = None, ndim: int = 0 ) -> Reducer:
+        if reduction_method is None: reduction_method = "autoencoder" if reducer_file.endswith(".h5") else "pca"
+        self._reducer = self.getReducer( reduction_method, ndim ).load( reducer_file )
+        return self._reducer
+
     # def spectral_reduction(data, graph, n_components=3, sparsify=False):
     #     t0 = time.time()
     #     graph = graph.tocoo()
@@ -60,36 +129,160 @@ class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
     #     return rv
 
     def autoencoder_reduction( self, encoder_input: np.ndarray, ndim: int, epochs: int = 1 ) -> np.ndarray:
-        input_dims = encoder_input.shape[1]
+        encoder = self.train_autoencoder( encoder_input, ndim, epochs )
+        return encoder.predict( encoder_input )
+
+    @classmethod
+    def autoencoder_architecture( cls, input_dims: int, ndim: int ) -> Dict:
         reduction_factor = 1.7
-        inputlayer = Input( shape=[input_dims] )
-        activation = 'tanh'
-        encoded = None
-        layer_dims, x = input_dims, inputlayer
+        encoder_dims, layer_dims = [], input_dims
         while layer_dims > ndim:
-            x = Dense(layer_dims, activation=activation)(x)
+            encoder_dims.append( layer_dims )
             layer_dims = int( round( layer_dims / reduction_factor ))
-        layer_dims = ndim
+        decoder_dims, layer_dims = [], ndim
         while layer_dims < input_dims:
+            decoder_dims.append( layer_dims )
+            layer_dims = int( round( layer_dims * reduction_factor ))
+        return dict( encoder_dims=encoder_dims, decoder_dims=decoder_dims, activation='tanh', output_activation='sigmoid', loss='mse', optimizer='rmsprop', batch_size=256 )
+
+    def encoderCacheFile( self, encoder_input: np.ndarray, ndim: int, epochs: int, **kwargs ) -> str:
+        architecture = self.autoencoder_architecture( encoder_input.shape[1], ndim )
+        if self.patience > 0: kwargs.update( patience=self.patience, min_delta=self.min_delta )
+        hasher = hashlib.blake2b( digest_size=20 )
+        hasher.update( json.dumps( dict( shape=encoder_input.shape, ndim=ndim, epochs=epochs, architecture=architecture, **kwargs ), sort_keys=True ).encode() )
+        hasher.update( array_fingerprint( encoder_input ).encode() )
+        cache_dir = os.path.join( DataManager.instance().cache_dir, "encoders" )
+        os.makedirs( cache_dir, exist_ok=True )
+        return os.path.join( cache_dir, hasher.hexdigest() + ".h5" )
+
+    def cachedEncoder( self, cache_file: Optional[str] ) -> Optional["Model"]:
+        if (cache_file is None) or not os.path.isfile( cache_file ): return None
+        try:                        return self.load_encoder( cache_file )
+        except Exception as err:    print( f"Can't load cached encoder {cache_file}, retraining: {err}")
+
+    def build_autoencoder( self, input_dims: int, ndim: int ) -> Tuple["Model","Model"]:
+        from keras.layers import Input, Dense
+        from keras.models import Model
+        architecture = self.autoencoder_architecture( input_dims, ndim )
+        activation = architecture['activation']
+        inputlayer = Input( shape=[input_dims] )
+        encoded = None
+        x = inputlayer
+        for layer_dims in architecture['encoder_dims']:
+            x = Dense(layer_dims, activation=activation)(x)
+        for layer_dims in architecture['decoder_dims']:
             x = Dense(layer_dims, activation=activation)(x)
             if encoded is None: encoded = x
-            layer_dims = int( round( layer_dims * reduction_factor ))
-        decoded = Dense( input_dims, activation='sigmoid' )(x)
+        decoded = Dense( input_dims, activation=architecture['output_activation'] )(x)
 
-#        modelcheckpoint = ModelCheckpoint('xray_auto.weights', monitor='loss', verbose=1, save_best_only=True, save_weights_only=True, mode='auto', period=1)
-#        earlystopping = EarlyStopping(monitor='loss', min_delta=0., patience=100, verbose=1, mode='auto')
         autoencoder = Model(inputs=[inputlayer], outputs=[decoded])
         encoder = Model(inputs=[inputlayer], outputs=[encoded])
-        autoencoder.compile(loss='mse', optimizer='rmsprop')
+        autoencoder.compile(loss=architecture['loss'], optimizer=architecture['optimizer'])
+        return autoencoder, encoder
+
+    def fit_autoencoder( self, autoencoder: "Model", cache_file: str, epochs: int, *args, **kwargs ):
+        from keras.callbacks import Callback, EarlyStopping
+        checkpoint_dir = os.path.splitext( cache_file )[0] + ".ckpt"
+        weights_file = os.path.join( checkpoint_dir, "autoencoder.weights.h5" )
+        state_file = os.path.join( checkpoint_dir, "state.json" )
+        initial_epoch = 0
+        if os.path.isfile( state_file ) and os.path.isfile( weights_file ):
+            try:
+                with open( state_file ) as f: state = json.load( f )
+                autoencoder.load_weights( weights_file )
+                initial_epoch = state['epoch']
+                print( f"Resuming autoencoder training from checkpoint {checkpoint_dir} at epoch {initial_epoch}, loss = {state['loss']}")
+            except Exception as err:
+                print( f"Can't resume from checkpoint {checkpoint_dir}, restarting: {err}")
+        if initial_epoch < epochs:
+            os.makedirs( checkpoint_dir, exist_ok=True )
+            period = max( self.checkpoint_period, 1 )
 
-        autoencoder.fit( encoder_input, encoder_input, epochs=epochs, batch_size=256, shuffle=True )
-        return  encoder.predict( encoder_input )
+            class TrainingCheckpoint(Callback):
+                def on_epoch_end( self, epoch: int, logs: Dict = None ):
+                    if ( (epoch+1) % period == 0 ) or ( epoch+1 == epochs ):
+                        self.model.save_weights( weights_file )
+                        with open( state_file + ".tmp", "w" ) as f: json.dump( dict( epoch=epoch+1, loss=float( (logs or {}).get( 'loss', np.nan ) ) ), f )
+                        os.replace( state_file + ".tmp", state_file )
+
+            callbacks = [ TrainingCheckpoint() ]
+            if self.patience > 0: callbacks.append( EarlyStopping( monitor='loss', min_delta=self.min_delta, patience=self.patience, verbose=1, restore_best_weights=True ) )
+            autoencoder.fit( *args, epochs=epochs, initial_epoch=initial_epoch, callbacks=callbacks, **kwargs )
+        shutil.rmtree( checkpoint_dir, ignore_errors=True )
+
+    def train_autoencoder( self, encoder_input: np.ndarray, ndim: int, epochs: int = 1 ) -> "Model":
+        cache_file = self.encoderCacheFile( encoder_input, ndim, epochs )
+        encoder = self.cachedEncoder( cache_file ) if self.encoder_cache else None
+        if encoder is not None: return encoder
+        autoencoder, encoder = self.build_autoencoder( encoder_input.shape[1], ndim )
+        batch_size = self.autoencoder_architecture( encoder_input.shape[1], ndim )['batch_size']
+        self.fit_autoencoder( autoencoder, cache_file, epochs, encoder_input, encoder_input, batch_size=batch_size, shuffle=True )
+        self._encoder = encoder
+        if self.encoder_cache: self.save_encoder( cache_file )
+        return encoder
+
+    @classmethod
+    def sample_blocks( cls, data: np.ndarray, block_size: int, batch_size: int, seed: int = 0 ) -> Iterator[Tuple[np.ndarray,np.ndarray]]:
+        rng = np.random.default_rng( seed )
+        nblocks = math.ceil( data.shape[0] / block_size )
+        while True:
+            for iB in rng.permutation( nblocks ):
+                block = np.asarray( data[ iB*block_size: (iB+1)*block_size ], dtype=np.float32 )
+                block = block[ rng.permutation( block.shape[0] ) ]
+                for iS in range( 0, block.shape[0], batch_size ):
+                    batch = block[ iS: iS+batch_size ]
+                    yield batch, batch
+
+    @classmethod
+    def steps_per_epoch( cls, nsamples: int, block_size: int, batch_size: int ) -> int:
+        nfull, remainder = divmod( nsamples, block_size )
+        return nfull * math.ceil( block_size / batch_size ) + math.ceil( remainder / batch_size )
+
+    def train_autoencoder_blocks( self, encoder_input: np.ndarray, ndim: int, epochs: int, block_size: int ) -> "Model":
+        cache_file = self.encoderCacheFile( encoder_input, ndim, epochs, block_size=block_size )
+        encoder = self.cachedEncoder( cache_file ) if self.encoder_cache else None
+        if encoder is not None: return encoder
+        autoencoder, encoder = self.build_autoencoder( encoder_input.shape[1], ndim )
+        batch_size = self.autoencoder_architecture( encoder_input.shape[1], ndim )['batch_size']
+        block_size = max( block_size, batch_size )
+        steps = self.steps_per_epoch( encoder_input.shape[0], block_size, batch_size )
+        print( f"Training autoencoder on {encoder_input.shape[0]} samples in shuffled blocks of {block_size}, {steps} steps per epoch")
+        self.fit_autoencoder( autoencoder, cache_file, epochs, self.sample_blocks( encoder_input, block_size, batch_size ), steps_per_epoch=steps )
+        self._encoder = encoder
+        if self.encoder_cache: self.save_encoder( cache_file )
+        return encoder
+
+    @classmethod
+    def predict_blocks( cls, encode: Callable[[np.ndarray],np.ndarray], inputs: np.ndarray, ndim: int, block_size: int, output_file: str ) -> np.ndarray:
+        reduced: np.ndarray = np.lib.format.open_memmap( output_file, mode='w+', dtype=np.float32, shape=( inputs.shape[0], ndim ) )
+        for iR in range( 0, inputs.shape[0], block_size ):
+            block = encode( np.asarray( inputs[ iR: iR+block_size ], dtype=np.float32 ) )
+            reduced[ iR: iR+block.shape[0] ] = block
+        reduced.flush()
+        print( f"Wrote {reduced.shape} reduced data to {output_file}")
+        return reduced
+
+    def save_encoder( self, encoder_file: str ) -> Optional[str]:
+        if self._encoder is None: return None
+        self._encoder.save( encoder_file )
+        print( f"Saved encoder to {encoder_file}")
+        return encoder_file
+
+    def load_encoder( self, encoder_file: str ) -> "Model":
+        from keras.models import load_model
+        self._encoder = load_model( encoder_file, compile=False )
+        print( f"Loaded encoder from {encoder_file}")
+        return self._encoder
+
+    def warm_up( self ):
+        from .umap import warm_up
+        warm_up( n_components=self.ndim, n_neighbors=ActivationFlowManager.instance().nneighbors )
 
     def umap_init( self,  point_data: xa.DataArray, **kwargs ) -> Optional[np.ndarray]:
         self._state = self.NEW_DATA
         self._dsid = point_data.attrs['dsid']
         LabelsManager.instance().initLabelsData(point_data)
-        mapper: UMAP = self.getUMapper(self._dsid, self.ndim)
+        mapper: "UMAP" = self.getUMapper(self._dsid, self.ndim)
         mapper.scoord = point_data.coords['samples']
         mapper.input_data = point_data.values
         mapper.flow = ActivationFlowManager.instance().getActivationFlow(point_data)
@@ -103,18 +296,62 @@ class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
         return mapper.embedding
 
     def umap_embedding( self, **kwargs ) -> Optional[np.ndarray]:
-        mapper: UMAP = self.getUMapper(self._dsid, self.ndim)
+        mapper, labels_data = self.prepare_embedding( kwargs )
+        mapper.embed( mapper.input_data, mapper.flow.nnd, labels_data, **kwargs )
+        return mapper.embedding
+
+    def umap_embedding_task( self, **kwargs ) -> "LayoutTask":
+        self.cancel_embedding()
+        mapper, labels_data = self.prepare_embedding( kwargs )
+        if 0 < self.landmarks < mapper.input_data.shape[0]:
+            kwargs.setdefault( 'refine_epochs', self.refine_epochs )
+            self._embedding_task = mapper.embed_landmarks( mapper.input_data, mapper.flow.nnd, labels_data, n_landmarks=self.landmarks, **kwargs )
+        else:
+            self._embedding_task = mapper.embed_task( mapper.input_data, mapper.flow.nnd, labels_data, **kwargs )
+        return self._embedding_task
+
+    def prepare_embedding( self, kwargs: Dict ) -> Tuple["UMAP",np.ndarray]:
+        mapper: "UMAP" = self.getUMapper(self._dsid, self.ndim)
         if 'nepochs' not in kwargs.keys():   kwargs['nepochs'] = self.nepochs
         if 'alpha' not in kwargs.keys():   kwargs['alpha'] = self.alpha
         self._state = self.PROCESSED
         labels_data: np.ndarray = LabelsManager.instance().labels_data().values
         mapper.clear_initialization()
         mapper.init = mapper.embedding
-        mapper.embed( mapper.input_data, mapper.flow.nnd, labels_data, **kwargs )
+        return mapper, labels_data
+
+    @property
+    def embedding_task(self) -> Optional["LayoutTask"]:
+        return self._embedding_task
+
+    def pause_embedding(self):
+        if self._embedding_task is not None: self._embedding_task.pause()
+
+    def resume_embedding(self):
+        if self._embedding_task is not None: self._embedding_task.resume()
+
+    def cancel_embedding(self):
+        if self._embedding_task is not None:
+            self._embedding_task.cancel()
+            self._embedding_task.wait()
+
+    def umap_append( self, point_data: xa.DataArray ) -> Optional[np.ndarray]:
+        mapper: "UMAP" = self.getUMapper(self._dsid, self.ndim)
+        t0 = time.time()
+        mapper.append( point_data.values )
+        mapper.flow.appendNodeData( point_data )
+        mapper.scoord = mapper.flow.nodes.coords['samples']
+        LabelsManager.instance().initLabelsData( mapper.flow.nodes )
+        print( f"Appended {point_data.shape[0]} samples to the embedding in {time.time()-t0} sec")
         return mapper.embedding
 
+    def umap_transform( self, point_data: xa.DataArray, **kwargs ) -> Iterator[Tuple[int,np.ndarray]]:
+        mapper: "UMAP" = self.getUMapper(self._dsid, self.ndim)
+        kwargs.setdefault( 'batch_size', self.transform_batch_size )
+        return mapper.transform_batches( point_data.values, **kwargs )
+
     def xa_umap_embedding( self, **kwargs ) -> Optional[xa.DataArray]:
-        mapper: UMAP = self.getUMapper(self._dsid, self.ndim)
+        mapper: "UMAP" = self.getUMapper(self._dsid, self.ndim)
         if mapper.embedding is None: self.umap_embedding( **kwargs )
         return None if mapper.embedding is None else self.wrap_embedding( mapper.scoord, mapper.embedding, **kwargs )
 
@@ -122,12 +359,16 @@ class ReductionManager(tlc.SingletonConfigurable,AstroSingleton):
         ax_model = np.arange( embedding.shape[1] )
         return xa.DataArray( embedding, dims=['samples','model'], coords=dict( samples=ax_samples, model=ax_model ) )
 
-    def getUMapper(self, dsid: str, ndim: int ) -> UMAP:
+    def getUMapper(self, dsid: str, ndim: int ) -> "UMAP":
+        from .umap import UMAP
         mid = f"{ndim}-{dsid}"
         nneighbors = ActivationFlowManager.instance().nneighbors
         mapper = self._mapper.get( mid )
         if ( mapper is None ):
-            parms = dict( n_neighbors=nneighbors, init=self.init, target_weight=self.target_weight ); parms.update( **self.conf, n_components=ndim )
+            parms = dict( n_neighbors=nneighbors, init=self.init, target_weight=self.target_weight, deterministic=self.deterministic, vertex_order=self.vertex_order, repulsion=self.repulsion )
+            if self.seed >= 0:              parms['random_state'] = self.seed
+            elif self.deterministic:        parms['random_state'] = 0
+            parms.update( **self.conf, n_components=ndim )
             mapper = UMAP(**parms)
             self._mapper[mid] = mapper
         self._current_mapper = mapper
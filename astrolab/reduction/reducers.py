@@ -0,0 +1,174 @@
+from typing import List, Union, Tuple, Optional, Dict, Callable, Type
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import numpy as np, time, math, pickle, resource, tracemalloc
+
+_reducers: Dict[str,Type["Reducer"]] = {}
+
+def register_reducer( name: str ) -> Callable[[Type["Reducer"]],Type["Reducer"]]:
+    def register( cls: Type["Reducer"] ) -> Type["Reducer"]:
+        cls.name = name
+        _reducers[ name.lower() ] = cls
+        return cls
+    return register
+
+def available_reducers() -> List[str]:
+    return list( _reducers.keys() )
+
+def get_reducer( reduction_method: str, ndim: int, **kwargs ) -> "Reducer":
+    reducer_class = _reducers.get( reduction_method.lower() )
+    if reducer_class is None: raise ValueError( f"Unknown reduction method '{reduction_method}', available methods: {available_reducers()}" )
+    return reducer_class( ndim, **kwargs )
+
+@contextmanager
+def measure_reduction( metrics: Dict, trace_memory: bool = False ):
+    # ru_maxrss is the high-water mark of the whole process, so the reduction's own footprint is reported as the growth of
+    # that mark while it ran (zero if an earlier step already peaked higher).  tracemalloc only sees Python allocations.
+    max_rss0 = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss * 1024
+    tracing = trace_memory and not tracemalloc.is_tracing()
+    if tracing: tracemalloc.start()
+    elif trace_memory and hasattr( tracemalloc, 'reset_peak' ): tracemalloc.reset_peak()
+    t0 = time.time()
+    try:
+        yield metrics
+    finally:
+        metrics['wall_time'] = time.time() - t0
+        if trace_memory: metrics['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        if tracing: tracemalloc.stop()
+        metrics['process_max_rss'] = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss * 1024
+        metrics['max_rss_growth'] = metrics['process_max_rss'] - max_rss0
+
+class Reducer(ABC):
+    name: str = None
+    extension: str = ".pkl"
+
+    def __init__( self, ndim: int, **kwargs ):
+        self.ndim = ndim
+        self.model = None
+        self.block_size = kwargs.get( 'block_size', 10000 )
+
+    @abstractmethod
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        pass
+
+    def fit_blocks( self, inputs: np.ndarray, block_size: int, **kwargs ) -> "Reducer":
+        training_data = np.asarray( inputs[ ::max( 1, math.ceil( inputs.shape[0] / block_size ) ) ], dtype=np.float32 )
+        print( f"Training {self.name} reduction on {training_data.shape[0]} of {inputs.shape[0]} samples, block size = {block_size}")
+        return self.fit( training_data, **kwargs )
+
+    def transform( self, inputs: np.ndarray ) -> np.ndarray:
+        return self.model.transform( inputs ).astype( np.float32 )
+
+    def output_dims( self, input_dims: int ) -> int:
+        return self.ndim
+
+    def save( self, file_base: str ) -> Optional[str]:
+        if self.model is None: return None
+        reducer_file = file_base + self.extension
+        with open( reducer_file, 'wb' ) as f: pickle.dump( self.model, f )
+        print( f"Saved {self.name} reducer to {reducer_file}")
+        return reducer_file
+
+    def load( self, reducer_file: str ) -> "Reducer":
+        with open( reducer_file, 'rb' ) as f: self.model = pickle.load( f )
+        print( f"Loaded {self.name} reducer from {reducer_file}")
+        return self
+
+@register_reducer( "none" )
+class PassthroughReducer(Reducer):
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        return self
+
+    def transform( self, inputs: np.ndarray ) -> np.ndarray:
+        return inputs
+
+    def output_dims( self, input_dims: int ) -> int:
+        return input_dims
+
+    def save( self, file_base: str ) -> Optional[str]:
+        return None
+
+@register_reducer( "autoencoder" )
+class AutoencoderReducer(Reducer):
+    extension = ".h5"
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        from .embedding import ReductionManager
+        self.model = ReductionManager.instance().train_autoencoder( inputs, self.ndim, kwargs.get( 'nepochs', 1 ) )
+        return self
+
+    def fit_blocks( self, inputs: np.ndarray, block_size: int, **kwargs ) -> "Reducer":
+        from .embedding import ReductionManager
+        self.model = ReductionManager.instance().train_autoencoder_blocks( inputs, self.ndim, kwargs.get( 'nepochs', 1 ), block_size )
+        return self
+
+    def transform( self, inputs: np.ndarray ) -> np.ndarray:
+        return self.model.predict( inputs )
+
+    def save( self, file_base: str ) -> Optional[str]:
+        if self.model is None: return None
+        reducer_file = file_base + self.extension
+        self.model.save( reducer_file )
+        print( f"Saved encoder to {reducer_file}")
+        return reducer_file
+
+    def load( self, reducer_file: str ) -> "Reducer":
+        from .embedding import ReductionManager
+        self.model = ReductionManager.instance().load_encoder( reducer_file )
+        return self
+
+@register_reducer( "pca" )
+class PCAReducer(Reducer):
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        from sklearn.decomposition import PCA
+        t0 = time.time()
+        self.model = PCA( n_components=self.ndim, svd_solver='randomized', random_state=0 ).fit( inputs )
+        print( f"Fit randomized PCA on {inputs.shape} data in {time.time()-t0:.2f} sec, explained variance = {self.model.explained_variance_ratio_.sum():.3f}")
+        return self
+
+    def fit_blocks( self, inputs: np.ndarray, block_size: int, **kwargs ) -> "Reducer":
+        from sklearn.decomposition import IncrementalPCA
+        if block_size < self.ndim: raise ValueError( f"Incremental PCA block size ({block_size}) must be at least the number of components ({self.ndim})" )
+        if inputs.shape[0] < self.ndim: raise ValueError( f"Incremental PCA needs at least {self.ndim} samples, got {inputs.shape[0]}" )
+        t0 = time.time()
+        self.model = IncrementalPCA( n_components=self.ndim )
+        # Each partial_fit needs at least ndim rows: a short trailing block is fit together with the block before it
+        starts = list( range( 0, inputs.shape[0], block_size ) )
+        if inputs.shape[0] - starts[-1] < self.ndim: starts.pop()
+        for start, stop in zip( starts, starts[1:] + [ inputs.shape[0] ] ):
+            self.model.partial_fit( np.asarray( inputs[ start: stop ], dtype=np.float32 ) )
+        print( f"Fit incremental PCA on {inputs.shape} data in blocks of {block_size} in {time.time()-t0:.2f} sec, explained variance = {self.model.explained_variance_ratio_.sum():.3f}")
+        return self
+
+@register_reducer( "ipca" )
+class IncrementalPCAReducer(PCAReducer):
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        return self.fit_blocks( inputs, self.block_size, **kwargs )
+
+    def transform( self, inputs: np.ndarray ) -> np.ndarray:
+        blocks = [ self.model.transform( np.asarray( inputs[ iR: iR+self.block_size ], dtype=np.float32 ) ) for iR in range( 0, inputs.shape[0], self.block_size ) ]
+        return np.concatenate( blocks ).astype( np.float32 )
+
+@register_reducer( "random_projection" )
+class RandomProjectionReducer(Reducer):
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        from sklearn.random_projection import GaussianRandomProjection
+        self.model = GaussianRandomProjection( n_components=self.ndim, random_state=0 ).fit( inputs[:self.ndim+1] )
+        return self
+
+    def fit_blocks( self, inputs: np.ndarray, block_size: int, **kwargs ) -> "Reducer":
+        return self.fit( np.asarray( inputs[:self.ndim+1], dtype=np.float32 ), **kwargs )
+
+@register_reducer( "umap" )
+class UMAPReducer(Reducer):
+
+    def fit( self, inputs: np.ndarray, **kwargs ) -> "Reducer":
+        import umap
+        t0 = time.time()
+        self.model = umap.UMAP( n_components=self.ndim, random_state=0 ).fit( inputs )
+        print( f"Fit UMAP reduction on {inputs.shape} data in {time.time()-t0:.2f} sec")
+        return self
@@ -1,7 +1,9 @@
 from __future__ import print_function
 import locale
 from warnings import warn
-import time
+import time, threading, os, math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from scipy.optimize import curve_fit
 from sklearn.base import BaseEstimator
 from sklearn.utils import check_random_state, check_array
@@ -16,15 +18,16 @@ import numpy as np
 import xarray as xa
 import scipy.sparse
 import scipy.sparse.csgraph
+import scipy.fft
 import umap.distances as dist
 import umap.sparse as sparse
 import numba
 from umap.utils import ( tau_rand_int, ts)
 from umap.spectral import spectral_layout
 from umap.layouts import ( optimize_layout_generic, optimize_layout_inverse )
-from pynndescent import NNDescent
-from pynndescent.distances import named_distances as pynn_named_distances
-from pynndescent.sparse import sparse_named_distances as pynn_sparse_named_distances
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from pynndescent import NNDescent
 _HAVE_PYNNDESCENT = True
 
 locale.setlocale(locale.LC_NUMERIC, "C")
@@ -36,7 +39,7 @@ SMOOTH_K_TOLERANCE = 1e-5
 MIN_K_DIST_SCALE = 1e-3
 NPY_INFINITY = np.inf
 
-@numba.njit()
+@numba.njit(cache=True)
 def clip(val):
     if val > 4.0:
         return 4.0
@@ -64,6 +67,84 @@ def rdist(x, y):
     return result
 
 
+@numba.njit(fastmath=True, cache=True, nogil=True)
+def _optimize_layout_euclidean_edge(
+    i,
+    head_embedding,
+    tail_embedding,
+    head,
+    tail,
+    n_vertices,
+    epochs_per_sample,
+    a,
+    b,
+    rng_state,
+    gamma,
+    dim,
+    move_other,
+    alpha,
+    epochs_per_negative_sample,
+    epoch_of_next_negative_sample,
+    epoch_of_next_sample,
+    n,
+):
+    if epoch_of_next_sample[i] <= n:
+        j = head[i]
+        k = tail[i]
+
+        current = head_embedding[j]
+        other = tail_embedding[k]
+
+        dist_squared = rdist(current, other)
+
+        if dist_squared > 0.0:
+            grad_coeff = -2.0 * a * b * pow(dist_squared, b - 1.0)
+            grad_coeff /= a * pow(dist_squared, b) + 1.0
+        else:
+            grad_coeff = 0.0
+
+        for d in range(dim):
+            grad_d = clip(grad_coeff * (current[d] - other[d]))
+            current[d] += grad_d * alpha
+            if move_other:
+                other[d] += -grad_d * alpha
+
+        epoch_of_next_sample[i] += epochs_per_sample[i]
+
+        n_neg_samples = int(
+            (n - epoch_of_next_negative_sample[i]) / epochs_per_negative_sample[i]
+        )
+
+        for p in range(n_neg_samples):
+            k = tau_rand_int(rng_state) % n_vertices
+
+            other = tail_embedding[k]
+
+            dist_squared = rdist(current, other)
+
+            if dist_squared > 0.0:
+                grad_coeff = 2.0 * gamma * b
+                grad_coeff /= (0.001 + dist_squared) * (
+                    a * pow(dist_squared, b) + 1
+                )
+            elif j == k:
+                continue
+            else:
+                grad_coeff = 0.0
+
+            for d in range(dim):
+                if grad_coeff > 0.0:
+                    grad_d = clip(grad_coeff * (current[d] - other[d]))
+                else:
+                    grad_d = 4.0
+                current[d] += grad_d * alpha
+
+        epoch_of_next_negative_sample[i] += (
+            n_neg_samples * epochs_per_negative_sample[i]
+        )
+
+
+@numba.njit(fastmath=True, cache=True, nogil=True)
 def _optimize_layout_euclidean_single_epoch(
     head_embedding,
     tail_embedding,
@@ -83,7 +164,145 @@ def _optimize_layout_euclidean_single_epoch(
     epoch_of_next_sample,
     n,
 ):
+    for i in range(epochs_per_sample.shape[0]):
+        _optimize_layout_euclidean_edge(
+            i,
+            head_embedding,
+            tail_embedding,
+            head,
+            tail,
+            n_vertices,
+            epochs_per_sample,
+            a,
+            b,
+            rng_state,
+            gamma,
+            dim,
+            move_other,
+            alpha,
+            epochs_per_negative_sample,
+            epoch_of_next_negative_sample,
+            epoch_of_next_sample,
+            n,
+        )
+
+
+@numba.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _optimize_layout_euclidean_single_epoch_parallel(
+    head_embedding,
+    tail_embedding,
+    head,
+    tail,
+    n_vertices,
+    epochs_per_sample,
+    a,
+    b,
+    rng_state,
+    gamma,
+    dim,
+    move_other,
+    alpha,
+    epochs_per_negative_sample,
+    epoch_of_next_negative_sample,
+    epoch_of_next_sample,
+    n,
+):
+    for i in numba.prange(epochs_per_sample.shape[0]):
+        _optimize_layout_euclidean_edge(
+            i,
+            head_embedding,
+            tail_embedding,
+            head,
+            tail,
+            n_vertices,
+            epochs_per_sample,
+            a,
+            b,
+            rng_state,
+            gamma,
+            dim,
+            move_other,
+            alpha,
+            epochs_per_negative_sample,
+            epoch_of_next_negative_sample,
+            epoch_of_next_sample,
+            n,
+        )
+
+
+@numba.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _optimize_layout_euclidean_deterministic_epoch(
+    head_embedding,
+    tail_embedding,
+    head,
+    tail,
+    n_vertices,
+    epochs_per_sample,
+    a,
+    b,
+    block_starts,
+    rng_states,
+    gamma,
+    dim,
+    alpha,
+    epochs_per_negative_sample,
+    epoch_of_next_negative_sample,
+    epoch_of_next_sample,
+    n,
+):
+    """One epoch over edges sorted by head and split into blocks that each
+    own all edges of their head vertices. Blocks run in parallel with
+    their own rng state, write only to their own head rows and read other
+    vertices from ``tail_embedding`` (a snapshot taken at the start of the
+    epoch), so the result does not depend on the number of threads."""
+    for ib in numba.prange(block_starts.shape[0] - 1):
+        rng_state = rng_states[ib]
+        for i in range(block_starts[ib], block_starts[ib + 1]):
+            _optimize_layout_euclidean_edge(
+                i,
+                head_embedding,
+                tail_embedding,
+                head,
+                tail,
+                n_vertices,
+                epochs_per_sample,
+                a,
+                b,
+                rng_state,
+                gamma,
+                dim,
+                False,
+                alpha,
+                epochs_per_negative_sample,
+                epoch_of_next_negative_sample,
+                epoch_of_next_sample,
+                n,
+            )
+
+
+@numba.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _optimize_layout_euclidean_attraction_epoch(
+    head_embedding,
+    tail_embedding,
+    head,
+    tail,
+    epochs_per_sample,
+    a,
+    b,
+    dim,
+    move_other,
+    alpha,
+    epochs_per_negative_sample,
+    epoch_of_next_negative_sample,
+    epoch_of_next_sample,
+    n,
+    n_neg_samples,
+):
+    """The positive sample updates of one epoch. Instead of drawing its
+    negative samples, each sampled edge stores their number in
+    ``n_neg_samples`` for an approximate repulsion step (``grid_repulsion``)."""
     for i in numba.prange(epochs_per_sample.shape[0]):
+        n_neg_samples[i] = 0
         if epoch_of_next_sample[i] <= n:
             j = head[i]
             k = tail[i]
@@ -107,37 +326,219 @@ def _optimize_layout_euclidean_single_epoch(
 
             epoch_of_next_sample[i] += epochs_per_sample[i]
 
-            n_neg_samples = int(
+            n_neg = int(
                 (n - epoch_of_next_negative_sample[i]) / epochs_per_negative_sample[i]
             )
+            n_neg_samples[i] = n_neg
+            epoch_of_next_negative_sample[i] += (
+                n_neg * epochs_per_negative_sample[i]
+            )
 
-            for p in range(n_neg_samples):
-                k = tau_rand_int(rng_state) % n_vertices
-
-                other = tail_embedding[k]
-
-                dist_squared = rdist(current, other)
 
-                if dist_squared > 0.0:
-                    grad_coeff = 2.0 * gamma * b
-                    grad_coeff /= (0.001 + dist_squared) * (
-                        a * pow(dist_squared, b) + 1
-                    )
-                elif j == k:
-                    continue
+@numba.njit(fastmath=True, cache=True, nogil=True)
+def _cic_cell(x, lo, h, grid_size):
+    u = (x - lo) / h
+    i0 = min(max(int(np.floor(u)), 0), grid_size - 2)
+    return i0, min(max(u - i0, 0.0), 1.0)
+
+
+@numba.njit(fastmath=True, cache=True, nogil=True)
+def cic_density(points, lo, h, grid_size, density):
+    """Deposit unit masses at the 3-D ``points`` on a regular grid with
+    origin ``lo`` and spacing ``h`` by cloud-in-cell (trilinear) weights."""
+    for p in range(points.shape[0]):
+        i, fx = _cic_cell(points[p, 0], lo[0], h, grid_size)
+        j, fy = _cic_cell(points[p, 1], lo[1], h, grid_size)
+        k, fz = _cic_cell(points[p, 2], lo[2], h, grid_size)
+        for c in range(8):
+            di, dj, dk = c & 1, (c >> 1) & 1, (c >> 2) & 1
+            w = (fx if di else 1.0 - fx) * (fy if dj else 1.0 - fy) * (fz if dk else 1.0 - fz)
+            density[i + di, j + dj, k + dk] += w
+
+
+@numba.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def cic_repulsion(points, lo, h, grid_size, field, counts, alpha):
+    """Move each of the 3-D ``points`` by ``counts[p]`` times the (clipped)
+    repulsive ``field`` interpolated at the point with cloud-in-cell
+    weights, scaled by the learning rate ``alpha``."""
+    for p in numba.prange(points.shape[0]):
+        if counts[p] <= 0.0:
+            continue
+        i, fx = _cic_cell(points[p, 0], lo[0], h, grid_size)
+        j, fy = _cic_cell(points[p, 1], lo[1], h, grid_size)
+        k, fz = _cic_cell(points[p, 2], lo[2], h, grid_size)
+        for d in range(3):
+            force = 0.0
+            for c in range(8):
+                di, dj, dk = c & 1, (c >> 1) & 1, (c >> 2) & 1
+                w = (fx if di else 1.0 - fx) * (fy if dj else 1.0 - fy) * (fz if dk else 1.0 - fz)
+                force += w * field[d, i + di, j + dj, k + dk]
+            points[p, d] += clip(force) * counts[p] * alpha
+
+
+@numba.njit(fastmath=True, cache=True, nogil=True)
+def _near_cell(x, lo, cell_size, n_cells):
+    return min(max(int((x - lo) / cell_size), 0), n_cells - 1)
+
+
+@numba.njit(cache=True, nogil=True)
+def cell_list(points, lo, cell_size, n_cells):
+    """Bin the 3-D ``points`` into ``n_cells``^3 cubic cells of side
+    ``cell_size`` with origin ``lo``: the points of cell ``c`` are
+    ``members[starts[c]:starts[c+1]]``."""
+    cells = np.empty(points.shape[0], dtype=np.int64)
+    starts = np.zeros(n_cells * n_cells * n_cells + 1, dtype=np.int64)
+    for p in range(points.shape[0]):
+        i = _near_cell(points[p, 0], lo[0], cell_size, n_cells)
+        j = _near_cell(points[p, 1], lo[1], cell_size, n_cells)
+        k = _near_cell(points[p, 2], lo[2], cell_size, n_cells)
+        cells[p] = (i * n_cells + j) * n_cells + k
+        starts[cells[p] + 1] += 1
+    for c in range(n_cells * n_cells * n_cells):
+        starts[c + 1] += starts[c]
+    fill = starts[:-1].copy()
+    members = np.empty(points.shape[0], dtype=np.int64)
+    for p in range(points.shape[0]):
+        members[fill[cells[p]]] = p
+        fill[cells[p]] += 1
+    return starts, members
+
+
+@numba.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def near_repulsion(
+    head_embedding, tail_embedding, counts, lo, cell_size, n_cells, starts, members, a, b, gamma, alpha
+):
+    """The short range part of the negative sampling of an epoch. Of the
+    ``counts[j]`` uniform negative samples of head vertex ``j``, a fraction
+    (the share of tail vertices in the 27 cells around ``j``) falls near
+    ``j``; that many samples are drawn from those cells, and the ones
+    closer than ``cell_size`` push ``j`` exactly as in the sampling
+    engine."""
+    cutoff_squared = cell_size * cell_size
+    n_tail = tail_embedding.shape[0]
+    for j in numba.prange(head_embedding.shape[0]):
+        if counts[j] <= 0.0:
+            continue
+        current = head_embedding[j]
+        ci = _near_cell(current[0], lo[0], cell_size, n_cells)
+        cj = _near_cell(current[1], lo[1], cell_size, n_cells)
+        ck = _near_cell(current[2], lo[2], cell_size, n_cells)
+        i0, i1 = max(ci - 1, 0), min(ci + 1, n_cells - 1)
+        j0, j1 = max(cj - 1, 0), min(cj + 1, n_cells - 1)
+        k0, k1 = max(ck - 1, 0), min(ck + 1, n_cells - 1)
+        n_near = 0
+        for ii in range(i0, i1 + 1):
+            for jj in range(j0, j1 + 1):
+                c = (ii * n_cells + jj) * n_cells
+                n_near += starts[c + k1 + 1] - starts[c + k0]
+        expected = counts[j] * n_near / n_tail
+        n_samples = int(expected)
+        if np.random.random() < expected - n_samples:
+            n_samples += 1
+        for p in range(n_samples):
+            r = min(int(np.random.random() * n_near), n_near - 1)
+            k = -1
+            for ii in range(i0, i1 + 1):
+                if k >= 0:
+                    break
+                for jj in range(j0, j1 + 1):
+                    c = (ii * n_cells + jj) * n_cells
+                    size = starts[c + k1 + 1] - starts[c + k0]
+                    if r < size:
+                        k = members[starts[c + k0] + r]
+                        break
+                    r -= size
+            if k == j:
+                continue
+            other = tail_embedding[k]
+            dist_squared = rdist(current, other)
+            if dist_squared >= cutoff_squared:
+                continue
+            if dist_squared > 0.0:
+                grad_coeff = 2.0 * gamma * b
+                grad_coeff /= (0.001 + dist_squared) * (a * pow(dist_squared, b) + 1)
+            else:
+                grad_coeff = 0.0
+            for d in range(3):
+                if grad_coeff > 0.0:
+                    grad_d = clip(grad_coeff * (current[d] - other[d]))
                 else:
-                    grad_coeff = 0.0
+                    grad_d = 4.0
+                current[d] += grad_d * alpha
 
-                for d in range(dim):
-                    if grad_coeff > 0.0:
-                        grad_d = clip(grad_coeff * (current[d] - other[d]))
-                    else:
-                        grad_d = 4.0
-                    current[d] += grad_d * alpha
 
-            epoch_of_next_negative_sample[i] += (
-                n_neg_samples * epochs_per_negative_sample[i]
-            )
+def repulsion_field(density, h, a, b, gamma, n_points, cutoff):
+    """The mean long range UMAP repulsive gradient exerted on each node of
+    a 3-D grid by a uniformly drawn point of ``density``. The repulsion is
+    the gradient of the potential ``gamma * log(1 + 1 / (a * d^(2b)))``,
+    held constant below ``cutoff`` (which ``near_repulsion`` handles);
+    the potential is computed by single precision FFT convolution of the
+    density on a zero padded grid and differentiated on the grid.
+
+    Returns
+    -------
+    field: array of shape (3, grid_size, grid_size, grid_size)
+        The components of the mean repulsive gradient.
+    """
+    grid_size = density.shape[0]
+    shape = (2 * grid_size,) * 3
+    # The kernel is radial: evaluate it on one octant of offsets and mirror
+    # it into the wrapped (FFT) order by indexing.
+    offsets = np.arange(grid_size + 1, dtype=np.float32) * np.float32(h)
+    rx, ry, rz = np.meshgrid(offsets, offsets, offsets, indexing="ij", sparse=True)
+    dist_squared = np.maximum(rx * rx + ry * ry + rz * rz, np.float32(cutoff * cutoff))
+    octant = np.float32(gamma) * np.log1p(np.float32(1.0 / a) / np.power(dist_squared, np.float32(b)))
+    wrapped = np.abs(np.fft.fftfreq(2 * grid_size, 1.0 / (2 * grid_size))).astype(np.intp)
+    kernel = octant[np.ix_(wrapped, wrapped, wrapped)]
+    potential = scipy.fft.irfftn(
+        scipy.fft.rfftn(density.astype(np.float32), shape, workers=-1) * scipy.fft.rfftn(kernel, workers=-1),
+        shape,
+        workers=-1,
+    )[:grid_size, :grid_size, :grid_size]
+    return -np.array(np.gradient(potential, h), dtype=np.float32) / np.float32(n_points)
+
+
+def grid_repulsion(head_embedding, tail_embedding, counts, a, b, gamma, alpha, grid_size=64):
+    """Approximate the negative sampling of an epoch: rather than pushing
+    each head vertex away from ``counts[j]`` random tail vertices, push it
+    exactly from the (few) samples that land within two grid spacings
+    (``near_repulsion``), and ``counts[j]`` times along the mean repulsive
+    gradient of all farther tail vertices, evaluated on a ``grid_size``^3
+    grid by ``repulsion_field``. The cost is O(n_vertices + grid_size^3 log
+    grid_size) per epoch plus the near samples, rather than O(n_edges *
+    negative_sample_rate)."""
+    lo = np.minimum(head_embedding.min(0), tail_embedding.min(0))
+    hi = np.maximum(head_embedding.max(0), tail_embedding.max(0))
+    extent = max(float((hi - lo).max()), 1e-6)
+    h = extent / (grid_size - 1)
+    cutoff = 2.0 * h
+    n_cells = int(extent / cutoff) + 1
+    starts, members = cell_list(tail_embedding, lo, cutoff, n_cells)
+    density = np.zeros((grid_size,) * 3, dtype=np.float64)
+    cic_density(tail_embedding, lo, h, grid_size, density)
+    near_repulsion(head_embedding, tail_embedding, counts, lo, cutoff, n_cells, starts, members, a, b, gamma, alpha)
+    field = repulsion_field(density, h, a, b, gamma, tail_embedding.shape[0], cutoff)
+    cic_repulsion(head_embedding, lo, h, grid_size, field, counts, alpha)
+
+
+def head_blocks(head, block_size):
+    """Start offsets of edge blocks of about ``block_size`` edges for edges
+    sorted by head, moved back to head boundaries so that no head vertex
+    is shared between blocks; the last entry is the number of edges."""
+    candidates = np.arange(0, head.shape[0], max(int(block_size), 1))
+    starts = np.unique(np.searchsorted(head, head[candidates], side="left"))
+    return np.append(starts, head.shape[0]).astype(np.int64)
+
+
+def reverse_cuthill_mckee_order(head, tail, n_vertices):
+    """A locality preserving ordering of the vertices of the graph with
+    edges (``head``, ``tail``): vertex ``order[r]`` is stored at row ``r``
+    so that neighbors end up in nearby rows of the embedding."""
+    adjacency = scipy.sparse.csr_matrix(
+        (np.ones(head.shape[0], dtype=np.int8), (head, tail)),
+        shape=(n_vertices, n_vertices),
+    )
+    return scipy.sparse.csgraph.reverse_cuthill_mckee(adjacency, symmetric_mode=False).astype(np.int64)
 
 
 def breadth_first_search(adjmat, start, min_vertices):
@@ -491,7 +892,7 @@ def fuzzy_simplicial_set(
 
     return result, sigmas, rhos
 
-@numba.njit()
+@numba.njit(cache=True)
 def fast_intersection(rows, cols, values, target, unknown_dist=1.0, far_dist=5.0):
     """Under the assumption of categorical distance for the intersecting
     simplicial set perform a fast intersection.
@@ -533,6 +934,66 @@ def fast_intersection(rows, cols, values, target, unknown_dist=1.0, far_dist=5.0
 
     return
 
+@numba.njit(cache=True)
+def csr_row_positions(rows, indptr):
+    """Positions in the CSR data array of all entries in the given rows."""
+    n_positions = 0
+    for i in rows:
+        n_positions += indptr[i + 1] - indptr[i]
+    positions = np.empty(n_positions, dtype=np.int64)
+    ip = 0
+    for i in rows:
+        for p in range(indptr[i], indptr[i + 1]):
+            positions[ip] = p
+            ip += 1
+    return positions
+
+
+@numba.njit(cache=True)
+def scale_categorical_edges(
+    positions, rows, cols, base, target, scaled, unknown_dist=1.0, far_dist=5.0
+):
+    """Recompute the categorical intersection of the given CSR entries from
+    their unsupervised values, as ``fast_intersection`` does for all entries."""
+    unknown_scale = np.exp(-unknown_dist)
+    far_scale = np.exp(-far_dist)
+    for p in positions:
+        i = rows[p]
+        j = cols[p]
+        if (target[i] == -1) or (target[j] == -1):
+            scaled[p] = base[p] * unknown_scale
+        elif target[i] != target[j]:
+            scaled[p] = base[p] * far_scale
+        else:
+            scaled[p] = base[p]
+    return
+
+
+@numba.njit(cache=True)
+def max_normalize_rows(rows, indptr, scaled, normalized):
+    """Row-wise max normalization of the given CSR rows."""
+    for i in rows:
+        row_max = 0.0
+        for p in range(indptr[i], indptr[i + 1]):
+            row_max = max(row_max, abs(scaled[p]))
+        if row_max == 0.0:
+            row_max = 1.0
+        for p in range(indptr[i], indptr[i + 1]):
+            normalized[p] = scaled[p] / row_max
+    return
+
+
+@numba.njit(cache=True)
+def fuzzy_union_rows(rows, indptr, transpose_positions, normalized, fuzzy):
+    """Fuzzy union N + N^T - N * N^T of a normalized simplicial set at the
+    entries of the given CSR rows and at their transposed entries."""
+    for i in rows:
+        for p in range(indptr[i], indptr[i + 1]):
+            q = transpose_positions[p]
+            fuzzy[p] = normalized[p] + normalized[q] - normalized[p] * normalized[q]
+            fuzzy[q] = fuzzy[p]
+    return
+
 @numba.jit()
 def fast_metric_intersection(
     rows, cols, values, discrete_space, metric, metric_args, scale
@@ -575,7 +1036,7 @@ def fast_metric_intersection(
 
     return
 
-@numba.njit()
+@numba.njit(cache=True)
 def reprocess_row(probabilities, k=15, n_iters=32):
     target = np.log2(k)
 
@@ -604,7 +1065,7 @@ def reprocess_row(probabilities, k=15, n_iters=32):
 
     return np.power(probabilities, mid)
 
-@numba.njit()
+@numba.njit(cache=True)
 def reset_local_metrics(simplicial_set_indptr, simplicial_set_data):
     for i in range(simplicial_set_indptr.shape[0] - 1):
         simplicial_set_data[
@@ -724,6 +1185,111 @@ def discrete_metric_simplicial_set_intersection(
     return reset_local_connectivity(simplicial_set)
 
 
+class CategoricalIntersection(object):
+    """Categorical label intersection of a fuzzy simplicial set that is
+    updated incrementally as labels change.
+
+    The result equals ``discrete_metric_simplicial_set_intersection`` of
+    ``simplicial_set`` with the current labels (up to explicit zeros),
+    but after the first call only the edges incident to relabelled points
+    are rescaled, and only the rows containing them are renormalized.
+
+    Parameters
+    ----------
+    simplicial_set: sparse matrix
+        The (structurally symmetric) unsupervised fuzzy simplicial set.
+
+    unknown_dist: float (optional, default 1.0)
+        The distance an unknown label (-1) is assumed to be from any point.
+
+    far_dist: float (optional, default 5.0)
+        The distance between unmatched labels.
+    """
+
+    def __init__(self, simplicial_set, unknown_dist=1.0, far_dist=5.0):
+        self.simplicial_set = simplicial_set
+        self.unknown_dist = unknown_dist
+        self.far_dist = far_dist
+        csr = simplicial_set.tocsr(copy=True)
+        csr.sum_duplicates()
+        csr.sort_indices()
+        self.shape = csr.shape
+        self.indptr = csr.indptr
+        self.indices = csr.indices
+        self.base = csr.data
+        self.rows = np.repeat(
+            np.arange(self.shape[0], dtype=self.indices.dtype), np.diff(self.indptr)
+        )
+        positions = scipy.sparse.csr_matrix(
+            (np.arange(self.base.shape[0], dtype=np.int64), self.indices, self.indptr),
+            shape=self.shape,
+        )
+        transpose = positions.transpose().tocsr()
+        transpose.sort_indices()
+        self.symmetric = np.array_equal(transpose.indptr, self.indptr) and np.array_equal(
+            transpose.indices, self.indices
+        )
+        self.transpose_positions = transpose.data
+        self.labels = None
+        self.scaled = np.empty_like(self.base)
+        self.normalized = np.empty_like(self.base)
+        self.fuzzy = np.empty_like(self.base)
+
+    def matches(self, simplicial_set, unknown_dist=1.0, far_dist=5.0):
+        return (
+            (self.simplicial_set is simplicial_set)
+            and (self.unknown_dist == unknown_dist)
+            and (self.far_dist == far_dist)
+        )
+
+    def update(self, target):
+        """Intersect with the labels ``target``, recomputing only what
+        differs from the previous call.
+
+        Parameters
+        ----------
+        target: array of shape (n_samples)
+            The categorical labels to use in the intersection.
+
+        Returns
+        -------
+        simplicial_set: sparse matrix
+            A new matrix holding the intersected fuzzy simplicial set.
+        """
+        target = np.asarray(target)
+        if self.labels is None:
+            positions = np.arange(self.base.shape[0], dtype=np.int64)
+            affected_rows = np.arange(self.shape[0], dtype=np.int64)
+        else:
+            changed = np.flatnonzero(target != self.labels)
+            positions = csr_row_positions(changed, self.indptr)
+            affected_rows = np.unique(np.concatenate([changed, self.indices[positions]]))
+            positions = np.concatenate([positions, self.transpose_positions[positions]])
+        self.labels = target.copy()
+        if affected_rows.shape[0] > 0:
+            scale_categorical_edges(
+                positions,
+                self.rows,
+                self.indices,
+                self.base,
+                self.labels,
+                self.scaled,
+                self.unknown_dist,
+                self.far_dist,
+            )
+            max_normalize_rows(affected_rows, self.indptr, self.scaled, self.normalized)
+            fuzzy_union_rows(
+                affected_rows,
+                self.indptr,
+                self.transpose_positions,
+                self.normalized,
+                self.fuzzy,
+            )
+        return scipy.sparse.csr_matrix(
+            (self.fuzzy.copy(), self.indices.copy(), self.indptr.copy()), shape=self.shape
+        )
+
+
 def general_simplicial_set_intersection(simplicial_set1, simplicial_set2, weight):
 
     result = (simplicial_set1 + simplicial_set2).tocoo()
@@ -784,7 +1350,7 @@ def spectral_embedding( data, graph, n_components = 3, sparsify = False ):
     return rv
 
 
-def simplicial_set_embedding(
+def simplicial_set_layout(
     data,
     graph,
     n_components,
@@ -800,26 +1366,135 @@ def simplicial_set_embedding(
     metric_kwds,
     parallel = True,
     verbose=False,
+    deterministic=False,
+    vertex_order=None,
+    repulsion="sampling",
 ):
-    """Perform a fuzzy simplicial set embedding, using a specified
-    initialisation method and then minimizing the fuzzy set cross entropy
-    between the 1-skeletons of the high and low dimensional fuzzy simplicial
-    sets.
+    """Initialize the low dimensional embedding of ``graph`` as for
+    ``simplicial_set_embedding`` and return it together with the
+    ``LayoutOptimization`` state that optimizes it, without running any
+    epochs. The parameters are those of ``simplicial_set_embedding``.
 
-    Parameters
-    ----------
-    data: array of shape (n_samples, n_features)
-        The source data to be embedded by UMAP.
+    Returns
+    -------
+    init_embedding: array of shape (n_samples, n_components)
+        The initial embedding.
 
-    graph: sparse matrix
-        The 1-skeleton of the high dimensional fuzzy simplicial set as
-        represented by a graph for which we require a sparse matrix for the
-        (weighted) adjacency matrix.
+    layout: LayoutOptimization
+        The resumable optimization of the (rescaled) initial embedding.
+    """
+    t0 = time.time()
+    graph = graph.tocoo()
+    graph.sum_duplicates()
+    n_vertices = graph.shape[1]
+    graph.data[graph.data < (graph.data.max() / float(n_epochs))] = 0.0
+    graph.eliminate_zeros()
+    init_embedding = None
 
-    n_components: int
-        The dimensionality of the euclidean space into which to embed the data.
+    if isinstance(init, str) and init == "random":
+        init_embedding = random_state.uniform(
+            low=-10.0, high=10.0, size=(graph.shape[0], n_components)
+        ).astype(np.float32)
+    elif isinstance(init, str) and init == "spectral":
+        # We add a little noise to avoid local minima for optimization to come
+        initialisation = spectral_layout(
+            data,
+            graph,
+            n_components,
+            random_state,
+            metric=metric,
+            metric_kwds=metric_kwds,
+        )
+        expansion = 10.0 / np.abs(initialisation).max()
+        spectral_embedding = (initialisation * expansion).astype(np.float32)
+        init_embedding = spectral_embedding + random_state.normal(scale=0.0001, size=[graph.shape[0], n_components]).astype( np.float32 )
+    else:
+        init_embedding = np.array(init)
+        # if len(init_data.shape) == 2:
+        #     if np.unique(init_data, axis=0).shape[0] < init_data.shape[0]:
+        #         tree = KDTree(init_data)
+        #         dist, ind = tree.query(init_data, k=2)
+        #         nndist = np.mean(dist[:, 1])
+        #         embedding = init_data + random_state.normal( scale=0.001 * nndist, size=init_data.shape ).astype(np.float32)
+        #     else:
+        #         embedding = init_data
 
-    initial_alpha: float
+    epochs_per_sample = make_epochs_per_sample(graph.data, n_epochs)
+
+    head = graph.row
+    tail = graph.col
+    weight = graph.data
+
+    rng_state = random_state.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+
+    embedding = ( 10.0 * ( init_embedding - np.min(init_embedding, 0) ) / (np.max(init_embedding, 0) - np.min(init_embedding, 0)) ).astype(np.float32, order="C")
+
+    layout = LayoutOptimization(
+        embedding,
+        embedding,
+        head,
+        tail,
+        n_epochs,
+        n_vertices,
+        epochs_per_sample,
+        a,
+        b,
+        rng_state,
+        gamma,
+        initial_alpha,
+        negative_sample_rate,
+        parallel=parallel,
+        verbose=verbose,
+        deterministic=deterministic,
+        vertex_order=vertex_order,
+        repulsion=repulsion,
+    )
+    print( f"Prepared simplicial set layout in {(time.time()-t0)/60.0} min")
+
+    return init_embedding, layout
+
+def simplicial_set_embedding(
+    data,
+    graph,
+    n_components,
+    initial_alpha,
+    a,
+    b,
+    gamma,
+    negative_sample_rate,
+    n_epochs,
+    init,
+    random_state,
+    metric,
+    metric_kwds,
+    parallel = True,
+    verbose=False,
+    progress_callback=None,
+    callback_interval=0,
+    frame_rate=0.0,
+    deterministic=False,
+    vertex_order=None,
+    repulsion="sampling",
+):
+    """Perform a fuzzy simplicial set embedding, using a specified
+    initialisation method and then minimizing the fuzzy set cross entropy
+    between the 1-skeletons of the high and low dimensional fuzzy simplicial
+    sets.
+
+    Parameters
+    ----------
+    data: array of shape (n_samples, n_features)
+        The source data to be embedded by UMAP.
+
+    graph: sparse matrix
+        The 1-skeleton of the high dimensional fuzzy simplicial set as
+        represented by a graph for which we require a sparse matrix for the
+        (weighted) adjacency matrix.
+
+    n_components: int
+        The dimensionality of the euclidean space into which to embed the data.
+
+    initial_alpha: float
         Initial learning rate for the SGD.
 
     a: float
@@ -873,6 +1548,28 @@ def simplicial_set_embedding(
     verbose: bool (optional, default False)
         Whether to report information on the current progress of the algorithm.
 
+    progress_callback: callable (optional, default None)
+        Called as ``progress_callback(n, embedding)`` with the number of
+        completed epochs and a snapshot (copy) of the current embedding.
+
+    callback_interval: int (optional, default 0)
+        If positive, invoke ``progress_callback`` every ``callback_interval``
+        epochs.
+
+    frame_rate: float (optional, default 0.0)
+        If positive, invoke ``progress_callback`` at most ``frame_rate``
+        times per second of optimization wall time.
+
+    deterministic: bool (optional, default False)
+        Use the thread count independent parallel SGD of
+        ``optimize_layout_euclidean``.
+
+    vertex_order: str (optional, default None)
+        The vertex reordering of ``optimize_layout_euclidean`` ("rcm" or None).
+
+    repulsion: str (optional, default "sampling")
+        The repulsion engine of ``optimize_layout_euclidean`` ("sampling" or "grid").
+
     Returns
     -------
     embedding: array of shape (n_samples, n_components)
@@ -880,68 +1577,31 @@ def simplicial_set_embedding(
         euclidean space.
     """
     t0 = time.time()
-    graph = graph.tocoo()
-    graph.sum_duplicates()
-    n_vertices = graph.shape[1]
-    graph.data[graph.data < (graph.data.max() / float(n_epochs))] = 0.0
-    graph.eliminate_zeros()
-    init_embedding = None
-
-    if isinstance(init, str) and init == "random":
-        init_embedding = random_state.uniform(
-            low=-10.0, high=10.0, size=(graph.shape[0], n_components)
-        ).astype(np.float32)
-    elif isinstance(init, str) and init == "spectral":
-        # We add a little noise to avoid local minima for optimization to come
-        initialisation = spectral_layout(
-            data,
-            graph,
-            n_components,
-            random_state,
-            metric=metric,
-            metric_kwds=metric_kwds,
-        )
-        expansion = 10.0 / np.abs(initialisation).max()
-        spectral_embedding = (initialisation * expansion).astype(np.float32)
-        init_embedding = spectral_embedding + random_state.normal(scale=0.0001, size=[graph.shape[0], n_components]).astype( np.float32 )
-    else:
-        init_embedding = np.array(init)
-        # if len(init_data.shape) == 2:
-        #     if np.unique(init_data, axis=0).shape[0] < init_data.shape[0]:
-        #         tree = KDTree(init_data)
-        #         dist, ind = tree.query(init_data, k=2)
-        #         nndist = np.mean(dist[:, 1])
-        #         embedding = init_data + random_state.normal( scale=0.001 * nndist, size=init_data.shape ).astype(np.float32)
-        #     else:
-        #         embedding = init_data
-
-    epochs_per_sample = make_epochs_per_sample(graph.data, n_epochs)
-
-    head = graph.row
-    tail = graph.col
-    weight = graph.data
-
-    rng_state = random_state.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
-
-    embedding = ( 10.0 * ( init_embedding - np.min(init_embedding, 0) ) / (np.max(init_embedding, 0) - np.min(init_embedding, 0)) ).astype(np.float32, order="C")
-
-    t1 = time.time()
-    embedding = optimize_layout_euclidean(
-        embedding,
-        embedding,
-        head,
-        tail,
-        n_epochs,
-        n_vertices,
-        epochs_per_sample,
+    init_embedding, layout = simplicial_set_layout(
+        data,
+        graph,
+        n_components,
+        initial_alpha,
         a,
         b,
-        rng_state,
         gamma,
-        initial_alpha,
         negative_sample_rate,
-        parallel = parallel,
-        verbose=verbose,
+        n_epochs,
+        init,
+        random_state,
+        metric,
+        metric_kwds,
+        parallel,
+        verbose,
+        deterministic,
+        vertex_order,
+        repulsion,
+    )
+    t1 = time.time()
+    embedding = layout.run(
+        progress_callback=progress_callback,
+        callback_interval=callback_interval,
+        frame_rate=frame_rate,
     )
     t2 = time.time()
 
@@ -965,6 +1625,15 @@ def optimize_layout_euclidean(
     negative_sample_rate=5.0,
     parallel=False,
     verbose=False,
+    progress_callback=None,
+    callback_interval=0,
+    frame_rate=0.0,
+    deterministic=False,
+    sort_edges=False,
+    vertex_order=None,
+    move_other=None,
+    repulsion="sampling",
+    grid_size=64,
 ):
     """Improve an embedding using stochastic gradient descent to minimize the
     fuzzy set cross entropy between the 1-skeletons of the high dimensional
@@ -1009,85 +1678,681 @@ def optimize_layout_euclidean(
         if a random seed has been set, to ensure reproducibility.
     verbose: bool (optional, default False)
         Whether to report information on the current progress of the algorithm.
+    progress_callback: callable (optional, default None)
+        Called as ``progress_callback(n, embedding)`` with the number of
+        completed epochs and a snapshot (copy) of the current embedding.
+    callback_interval: int (optional, default 0)
+        If positive, invoke ``progress_callback`` every ``callback_interval``
+        epochs.
+    frame_rate: float (optional, default 0.0)
+        If positive, invoke ``progress_callback`` at most ``frame_rate``
+        times per second of optimization wall time.
+    deterministic: bool (optional, default False)
+        Run the parallel SGD over fixed blocks of edges sorted by head, each
+        with its own rng stream, reading the other vertices from a snapshot
+        taken at the start of each epoch. Seeded runs then give identical
+        results for any number of threads. Tail vertices are not moved by
+        their edges; the symmetric edge of the graph moves them instead.
+    sort_edges: bool (optional, default False)
+        Process the edges ordered by head (and tail) vertex rather than in
+        the given order, so that consecutive edges reuse the same rows. The
+        COO order of a kNN graph is already grouped by row, so this rarely
+        pays for its setup; the deterministic mode and "rcm" always sort.
+    vertex_order: str (optional, default None)
+        If "rcm", optimize a copy of the embedding with its rows in reverse
+        Cuthill-McKee order, which keeps graph neighbors in nearby rows, and
+        copy it back into ``head_embedding`` after each epoch. Only used when
+        ``tail_embedding`` is ``head_embedding``.
+    move_other: bool (optional, default None)
+        Whether an edge also moves its tail vertex. By default this is the
+        case when head and tail embeddings have the same number of points,
+        which is the usual full embedding; pass False when optimizing new
+        points against a fixed embedding.
+    repulsion: str (optional, default "sampling")
+        How the repulsive forces are computed. "sampling" draws
+        ``negative_sample_rate`` random vertices per sampled edge. "grid"
+        (3-D only) draws only the samples that land within two grid
+        spacings of the vertex and applies the rest as pushes along the mean
+        repulsive gradient of the farther vertices, computed each epoch on a
+        grid by FFT convolution (see ``grid_repulsion``); it is cheaper for
+        large numbers of vertices.
+    grid_size: int (optional, default 64)
+        The number of grid nodes per dimension for ``repulsion="grid"``.
     Returns
     -------
     embedding: array of shape (n_samples, n_components)
         The optimized embedding.
     """
-    from astrolab.gui.points import  PointCloudManager
-    dim = head_embedding.shape[1]
-    move_other = head_embedding.shape[0] == tail_embedding.shape[0]
-    alpha = initial_alpha
-    epochs_per_negative_sample = epochs_per_sample / negative_sample_rate
-    epoch_of_next_negative_sample = epochs_per_negative_sample.copy()
-    epoch_of_next_sample = epochs_per_sample.copy()
-    optimize_fn = numba.njit( _optimize_layout_euclidean_single_epoch, fastmath=True, parallel=parallel )
-    if n_epochs == 1:
-        pass
-    else:
-      print( f" >>> Embed n_epochs={n_epochs}, alpha={alpha} ")
-      for n in range(n_epochs):
-        if dim == 3: PointCloudManager.instance().update_plot( points=head_embedding )
-        optimize_fn(
-            head_embedding,
-            tail_embedding,
-            head,
-            tail,
-            n_vertices,
-            epochs_per_sample,
-            a,
-            b,
-            rng_state,
-            gamma,
-            dim,
-            move_other,
-            alpha,
-            epochs_per_negative_sample,
-            epoch_of_next_negative_sample,
-            epoch_of_next_sample,
-            n,
+    layout = LayoutOptimization(
+        head_embedding,
+        tail_embedding,
+        head,
+        tail,
+        n_epochs,
+        n_vertices,
+        epochs_per_sample,
+        a,
+        b,
+        rng_state,
+        gamma,
+        initial_alpha,
+        negative_sample_rate,
+        parallel=parallel,
+        verbose=verbose,
+        deterministic=deterministic,
+        sort_edges=sort_edges,
+        vertex_order=vertex_order,
+        move_other=move_other,
+        repulsion=repulsion,
+        grid_size=grid_size,
+    )
+    return layout.run(
+        progress_callback=progress_callback,
+        callback_interval=callback_interval,
+        frame_rate=frame_rate,
+    )
+
+
+class LayoutOptimization(object):
+    """The resumable state of an ``optimize_layout_euclidean`` run: the
+    embedding, the per-edge sampling schedule, the rng state and the number
+    of completed epochs. ``run`` may be interrupted between epochs and
+    called again to continue from the last completed epoch.
+
+    The parameters are those of ``optimize_layout_euclidean``. ``embedding``
+    is the array the kernels update; it is ``head_embedding`` itself unless
+    the rows were reordered by ``vertex_order``.
+    """
+
+    def __init__(
+        self,
+        head_embedding,
+        tail_embedding,
+        head,
+        tail,
+        n_epochs,
+        n_vertices,
+        epochs_per_sample,
+        a,
+        b,
+        rng_state,
+        gamma=1.0,
+        initial_alpha=1.0,
+        negative_sample_rate=5.0,
+        parallel=False,
+        verbose=False,
+        deterministic=False,
+        block_size=4096,
+        sort_edges=False,
+        vertex_order=None,
+        move_other=None,
+        repulsion="sampling",
+        grid_size=64,
+    ):
+        if repulsion not in ("sampling", "grid"):
+            raise ValueError(f"Unknown repulsion '{repulsion}'")
+        if (repulsion == "grid") and (head_embedding.shape[1] != 3):
+            raise ValueError("Grid repulsion is only available for 3-D embeddings")
+        if (repulsion == "grid") and deterministic:
+            raise ValueError("Grid repulsion does not support the deterministic mode")
+        self.repulsion = repulsion
+        self.grid_size = grid_size
+        self.head_embedding = head_embedding
+        self.vertex_order = None
+        if (vertex_order == "rcm") and (tail_embedding is head_embedding):
+            # Optimize a copy with rows in locality preserving order and
+            # scatter it back into head_embedding after every epoch
+            self.vertex_order = reverse_cuthill_mckee_order(head, tail, n_vertices)
+            rank = np.empty_like(self.vertex_order)
+            rank[self.vertex_order] = np.arange(self.vertex_order.shape[0])
+            head, tail = rank[head], rank[tail]
+            head_embedding = tail_embedding = np.ascontiguousarray(head_embedding[self.vertex_order])
+        elif vertex_order not in (None, "none", "rcm"):
+            raise ValueError(f"Unknown vertex order '{vertex_order}'")
+        if sort_edges or deterministic or (self.vertex_order is not None):
+            order = np.lexsort((tail, head))
+            head, tail, epochs_per_sample = head[order], tail[order], epochs_per_sample[order]
+        if deterministic:
+            self.block_starts = head_blocks(head, block_size)
+            block_seeds = np.random.RandomState(int(np.abs(rng_state[0])) % (2 ** 32))
+            self.rng_states = block_seeds.randint(
+                INT32_MIN, INT32_MAX, (self.block_starts.shape[0] - 1, 3)
+            ).astype(np.int64)
+        self.deterministic = deterministic
+        self.embedding = head_embedding
+        self.tail_embedding = tail_embedding
+        self.head = np.ascontiguousarray(head, dtype=np.int32)
+        self.tail = np.ascontiguousarray(tail, dtype=np.int32)
+        self.n_epochs = n_epochs
+        self.n_vertices = n_vertices
+        self.epochs_per_sample = np.ascontiguousarray(epochs_per_sample, dtype=np.float32)
+        self.a = a
+        self.b = b
+        self.rng_state = rng_state
+        self.gamma = gamma
+        self.initial_alpha = initial_alpha
+        self.parallel = parallel
+        self.verbose = verbose
+        self.dim = head_embedding.shape[1]
+        self.move_other = (head_embedding.shape[0] == tail_embedding.shape[0]) if move_other is None else move_other
+        self.alpha = initial_alpha
+        self.epochs_per_negative_sample = self.epochs_per_sample / np.float32(negative_sample_rate)
+        self.epoch_of_next_negative_sample = self.epochs_per_negative_sample.copy()
+        self.epoch_of_next_sample = self.epochs_per_sample.copy()
+        self.n_neg_samples = np.zeros(self.epochs_per_sample.shape[0], dtype=np.int32) if repulsion == "grid" else None
+        self.epoch = 0
+
+    @property
+    def completed(self):
+        # A single-epoch layout only initializes the embedding (see umap_init)
+        return (self.n_epochs == 1) or (self.epoch >= self.n_epochs)
+
+    def step(self):
+        """Run one epoch of SGD and advance the schedule."""
+        n = self.epoch
+        if self.repulsion == "grid":
+            _optimize_layout_euclidean_attraction_epoch(
+                self.embedding,
+                self.tail_embedding,
+                self.head,
+                self.tail,
+                self.epochs_per_sample,
+                self.a,
+                self.b,
+                self.dim,
+                self.move_other,
+                self.alpha,
+                self.epochs_per_negative_sample,
+                self.epoch_of_next_negative_sample,
+                self.epoch_of_next_sample,
+                n,
+                self.n_neg_samples,
+            )
+            counts = np.bincount(self.head, weights=self.n_neg_samples, minlength=self.embedding.shape[0])
+            grid_repulsion(
+                self.embedding,
+                self.tail_embedding,
+                counts.astype(np.float32),
+                self.a,
+                self.b,
+                self.gamma,
+                self.alpha,
+                self.grid_size,
+            )
+        elif self.deterministic:
+            _optimize_layout_euclidean_deterministic_epoch(
+                self.embedding,
+                self.embedding.copy() if self.move_other else self.tail_embedding,
+                self.head,
+                self.tail,
+                self.n_vertices,
+                self.epochs_per_sample,
+                self.a,
+                self.b,
+                self.block_starts,
+                self.rng_states,
+                self.gamma,
+                self.dim,
+                self.alpha,
+                self.epochs_per_negative_sample,
+                self.epoch_of_next_negative_sample,
+                self.epoch_of_next_sample,
+                n,
+            )
+        else:
+            optimize_fn = _optimize_layout_euclidean_single_epoch_parallel if self.parallel else _optimize_layout_euclidean_single_epoch
+            optimize_fn(
+                self.embedding,
+                self.tail_embedding,
+                self.head,
+                self.tail,
+                self.n_vertices,
+                self.epochs_per_sample,
+                self.a,
+                self.b,
+                self.rng_state,
+                self.gamma,
+                self.dim,
+                self.move_other,
+                self.alpha,
+                self.epochs_per_negative_sample,
+                self.epoch_of_next_negative_sample,
+                self.epoch_of_next_sample,
+                n,
+            )
+        if self.vertex_order is not None:
+            self.head_embedding[self.vertex_order] = self.embedding
+        self.alpha = self.initial_alpha * (1.0 - (float(n) / float(self.n_epochs)))
+        self.epoch = n + 1
+
+        if self.verbose and n % max(int(self.n_epochs / 10), 1) == 0:
+            print("\tcompleted ", n, " / ", self.n_epochs, "epochs")
+
+    def run(
+        self,
+        progress_callback=None,
+        callback_interval=0,
+        frame_rate=0.0,
+        should_continue=None,
+    ):
+        """Optimize the layout until all epochs are completed or
+        ``should_continue()`` returns False before an epoch.
+
+        Parameters
+        ----------
+        progress_callback, callback_interval, frame_rate:
+            As for ``optimize_layout_euclidean``.
+        should_continue: callable (optional, default None)
+            Called before each epoch; the run stops, keeping its state,
+            when it returns False.
+
+        Returns
+        -------
+        embedding: array of shape (n_samples, n_components)
+            The (possibly partially) optimized embedding.
+        """
+        if self.completed:
+            return self.head_embedding
+        print( f" >>> Embed n_epochs={self.n_epochs}, epoch={self.epoch}, alpha={self.alpha} ")
+        frame_interval = 1.0 / frame_rate if frame_rate > 0 else 0.0
+        last_frame = time.time()
+        while self.epoch < self.n_epochs:
+            if (should_continue is not None) and not should_continue():
+                break
+            self.step()
+            n = self.epoch
+            if progress_callback is not None:
+                on_interval = (callback_interval > 0) and (n % callback_interval == 0)
+                on_frame = (frame_interval > 0) and (time.time() - last_frame >= frame_interval)
+                if on_interval or on_frame or (n == self.n_epochs):
+                    last_frame = time.time()
+                    progress_callback(n, self.head_embedding.copy())
+        return self.head_embedding
+
+
+class LayoutTask(object):
+    """Run a ``LayoutOptimization`` in a background thread that can be
+    paused, resumed and cancelled between epochs.
+
+    Parameters
+    ----------
+    layout: LayoutOptimization
+        The layout state to optimize; it is updated in place.
+    progress_callback, callback_interval, frame_rate:
+        As for ``optimize_layout_euclidean``.
+    on_complete: callable (optional, default None)
+        Called as ``on_complete(embedding)`` from the worker thread when
+        all epochs have completed.
+    """
+
+    def __init__(
+        self,
+        layout,
+        progress_callback=None,
+        callback_interval=0,
+        frame_rate=0.0,
+        on_complete=None,
+    ):
+        self.layout = layout
+        self.progress_callback = progress_callback
+        self.callback_interval = callback_interval
+        self.frame_rate = frame_rate
+        self.on_complete = on_complete
+        self._running = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = None
+        self.error = None
+
+    def _should_continue(self):
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+    def _run(self):
+        t0 = time.time()
+        try:
+            self.layout.run(
+                self.progress_callback,
+                self.callback_interval,
+                self.frame_rate,
+                self._should_continue,
+            )
+        except Exception as err:
+            self.error = err
+            print(f"Embedding task failed at epoch {self.layout.epoch}: {err}")
+            return
+        print(f"Embedding task stopped at epoch {self.layout.epoch}/{self.layout.n_epochs} after {time.time() - t0:.2f} sec")
+        if self.layout.completed and (self.on_complete is not None):
+            self.on_complete(self.layout.head_embedding)
+
+    def start(self):
+        """Start, or restart after ``cancel``, from the last completed epoch."""
+        if self.running:
+            return self
+        self._cancelled.clear()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        if self.running:
+            self._running.set()
+        else:
+            self.start()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.layout.completed
+
+    @property
+    def running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    @property
+    def paused(self):
+        return self.running and not self._running.is_set()
+
+    @property
+    def progress(self):
+        return self.layout.epoch, self.layout.n_epochs
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return "failed"
+        if self.layout.completed:
+            return "completed"
+        if self.paused:
+            return "paused"
+        if self.running:
+            return "running"
+        return "cancelled" if self._cancelled.is_set() else "pending"
+
+
+@numba.njit(cache=True)
+def init_transform(indices, weights, embedding):
+    """Given indices and weights and an original embeddings
+    initialize the positions of new points relative to the
+    indices and weights (of their neighbors in the source data).
+
+    Parameters
+    ----------
+    indices: array of shape (n_new_samples, n_neighbors)
+        The indices of the neighbors of each new sample
+
+    weights: array of shape (n_new_samples, n_neighbors)
+        The membership strengths of associated 1-simplices
+        for each of the new samples.
+
+    embedding: array of shape (n_samples, dim)
+        The original embedding of the source data.
+
+    Returns
+    -------
+    new_embedding: array of shape (n_new_samples, dim)
+        An initial embedding of the new sample points.
+    """
+    result = np.zeros((indices.shape[0], embedding.shape[1]), dtype=np.float32)
+
+    for i in range(indices.shape[0]):
+        for j in range(indices.shape[1]):
+            for d in range(embedding.shape[1]):
+                result[i, d] += weights[i, j] * embedding[indices[i, j], d]
+
+    return result
+
+
+@numba.njit(cache=True)
+def greedy_landmarks(knn_indices, order, n_cover):
+    """Choose landmarks from a kNN graph by visiting the vertices in
+    ``order`` and taking each vertex that is not yet covered, where a
+    landmark covers itself and its first ``n_cover`` neighbors other
+    than itself.
+
+    Parameters
+    ----------
+    knn_indices: array of shape (n_samples, n_neighbors)
+        The kNN graph; negative indices are missing neighbors.
+
+    order: array of shape (n_samples)
+        The order in which vertices are considered.
+
+    n_cover: int
+        The number of neighbors covered by a landmark.
+
+    Returns
+    -------
+    landmarks: array of int64
+        The indices of the landmarks, in the order they were taken.
+    """
+    covered = np.zeros(knn_indices.shape[0], dtype=np.bool_)
+    landmarks = np.empty(knn_indices.shape[0], dtype=np.int64)
+    n_landmarks = 0
+    for i in order:
+        if covered[i]:
+            continue
+        landmarks[n_landmarks] = i
+        n_landmarks += 1
+        covered[i] = True
+        n_covered = 0
+        for j in range(knn_indices.shape[1]):
+            if n_covered >= n_cover:
+                break
+            k = knn_indices[i, j]
+            if (k >= 0) and (k != i):
+                covered[k] = True
+                n_covered += 1
+    return landmarks[:n_landmarks]
+
+
+def select_landmarks(knn_indices, n_landmarks, random_state):
+    """Choose ``n_landmarks`` vertices spread over a kNN graph: a greedy
+    cover (``greedy_landmarks``) sized for the requested count, visited in
+    random order, is subsampled at random if it is too large, or completed
+    with random other vertices if it is too small.
+
+    Parameters
+    ----------
+    knn_indices: array of shape (n_samples, n_neighbors)
+        The kNN graph; negative indices are missing neighbors.
+
+    n_landmarks: int
+        The number of landmarks, at most ``n_samples``.
+
+    random_state: numpy RandomState
+        The state used for the visiting order and the subsampling.
+
+    Returns
+    -------
+    landmarks: array of int64
+        The sorted indices of the landmarks.
+    """
+    n_samples = knn_indices.shape[0]
+    n_landmarks = min(n_landmarks, n_samples)
+    n_cover = int(np.clip(np.ceil(n_samples / max(n_landmarks, 1)) - 1, 1, knn_indices.shape[1] - 1))
+    landmarks = greedy_landmarks(knn_indices, random_state.permutation(n_samples), n_cover)
+    if landmarks.shape[0] > n_landmarks:
+        landmarks = random_state.choice(landmarks, n_landmarks, replace=False)
+    elif landmarks.shape[0] < n_landmarks:
+        others = np.setdiff1d(np.arange(n_samples), landmarks)
+        landmarks = np.concatenate(
+            [landmarks, random_state.choice(others, n_landmarks - landmarks.shape[0], replace=False)]
         )
-   #     print( f" ITER Embed n={n}, alpha={alpha:.4f}, sample={head_embedding[0]}, dist={head_embedding[0]-head_embedding[1000]} ")
-        alpha = initial_alpha * (1.0 - (float(n) / float(n_epochs)))
+    return np.sort(landmarks)
+
+
+def landmark_graph(
+    landmark_data, n_neighbors, random_state, metric, metric_kwds={}, set_op_mix_ratio=1.0, local_connectivity=1.0
+):
+    """The fuzzy graph between landmarks: the fuzzy simplicial set of the
+    kNN graph of the landmarks themselves, so that it has at most
+    ``n_neighbors`` connections per landmark before symmetrization and
+    stays connected however sparse the landmarks are.
 
-        if verbose and n % int(n_epochs / 10) == 0:
-            print("\tcompleted ", n, " / ", n_epochs, "epochs")
+    Parameters
+    ----------
+    landmark_data: array of shape (n_landmarks, n_features)
+        The input data of the landmarks.
+
+    n_neighbors: int
+        The number of neighbors of each landmark.
 
-#      eventCentral.submitEvent(dict(event="gui", type="plot", value=head_embedding, reset_camera=False), EventMode.Gui)
+    random_state: numpy RandomState
+        The state used for the nearest neighbor search.
+
+    metric, metric_kwds, set_op_mix_ratio, local_connectivity:
+        As for ``fuzzy_simplicial_set``.
+
+    Returns
+    -------
+    landmark_graph: sparse matrix of shape (n_landmarks, n_landmarks)
+        The fuzzy graph of the landmarks, in coo format.
+    """
+    from pynndescent import NNDescent
+
+    n_neighbors = min(n_neighbors, landmark_data.shape[0])
+    nnd = NNDescent(landmark_data, n_neighbors=n_neighbors, metric=metric, metric_kwds=metric_kwds, random_state=random_state)
+    knn_indices, knn_dists = nnd.neighbor_graph
+    graph, sigmas, rhos = fuzzy_simplicial_set(
+        landmark_data,
+        n_neighbors,
+        random_state,
+        metric,
+        metric_kwds,
+        knn_indices,
+        knn_dists,
+        False,
+        set_op_mix_ratio,
+        local_connectivity,
+    )
+    return graph.tocoo()
 
-    return head_embedding
 
-@numba.njit()
-def init_transform(indices, weights, embedding):
-    """Given indices and weights and an original embeddings
-    initialize the positions of new points relative to the
-    indices and weights (of their neighbors in the source data).
+def landmark_placement(graph, landmarks, landmark_embedding, random_state):
+    """Place every vertex of ``graph`` at the membership weighted mean of
+    the embedding of its landmark neighbors, as ``init_transform`` places
+    new points, keeping the landmarks at ``landmark_embedding``. Vertices
+    without a landmark neighbor are placed in later rounds from their
+    neighbors placed in earlier rounds, and vertices that no round reaches
+    at a random landmark.
 
     Parameters
     ----------
-    indices: array of shape (n_new_samples, n_neighbors)
-        The indices of the neighbors of each new sample
+    graph: sparse matrix of shape (n_samples, n_samples)
+        The fuzzy graph of all vertices.
 
-    weights: array of shape (n_new_samples, n_neighbors)
-        The membership strengths of associated 1-simplices
-        for each of the new samples.
+    landmarks: array of shape (n_landmarks)
+        The indices of the landmarks.
 
-    embedding: array of shape (n_samples, dim)
-        The original embedding of the source data.
+    landmark_embedding: array of shape (n_landmarks, dim)
+        The embedding of the landmarks.
+
+    random_state: numpy RandomState
+        The state used for the fallback placement.
 
     Returns
     -------
-    new_embedding: array of shape (n_new_samples, dim)
-        An initial embedding of the new sample points.
+    embedding: array of shape (n_samples, dim)
+        The embedding of all vertices.
     """
-    result = np.zeros((indices.shape[0], embedding.shape[1]), dtype=np.float32)
+    graph = graph.tocsr()
+    embedding = np.zeros((graph.shape[0], landmark_embedding.shape[1]), dtype=np.float32)
+    embedding[landmarks] = landmark_embedding
+    placed = np.zeros(graph.shape[0], dtype=np.bool_)
+    placed[landmarks] = True
+    while not placed.all():
+        pending, sources = np.flatnonzero(~placed), np.flatnonzero(placed)
+        weights = graph[pending][:, sources]
+        reached = weights.getnnz(axis=1) > 0
+        if not reached.any():
+            break
+        weights = normalize(weights[reached], norm="l1")
+        embedding[pending[reached]] = weights @ embedding[sources]
+        placed[pending[reached]] = True
+    isolated = np.flatnonzero(~placed)
+    embedding[isolated] = landmark_embedding[
+        random_state.randint(0, landmarks.shape[0], isolated.shape[0])
+    ]
+    return embedding
 
-    for i in range(indices.shape[0]):
-        for j in range(indices.shape[1]):
-            for d in range(embedding.shape[1]):
-                result[i, d] += weights[i, j] * embedding[indices[i, j], d]
 
-    return result
+def warm_up(n_components=3, n_neighbors=5, verbose=True):
+    """Compile the numba kernels used to construct and optimize an embedding,
+    or load them from the on-disk cache, by running them on a tiny synthetic
+    graph with the argument types of a real embedding run.
+
+    Parameters
+    ----------
+    n_components: int (optional, default 3)
+        The embedding dimension to specialize the layout kernels for.
+
+    n_neighbors: int (optional, default 5)
+        The number of neighbors in the synthetic kNN graph.
+
+    verbose: bool (optional, default True)
+        Whether to report the time taken.
+    """
+    t0 = time.time()
+    n_vertices = 4 * (n_neighbors + 1)
+    random_state = np.random.RandomState(0)
+    knn_indices = (
+        np.arange(n_vertices, dtype=np.int32)[:, None]
+        + np.arange(n_neighbors + 1, dtype=np.int32)[None, :]
+    ) % n_vertices
+    knn_dists = np.sort(
+        random_state.uniform(size=knn_indices.shape).astype(np.float32), axis=1
+    )
+    knn_dists[:, 0] = 0.0
+    X = random_state.uniform(size=(n_vertices, n_components)).astype(np.float32)
+    graph, sigmas, rhos = fuzzy_simplicial_set(
+        X, n_neighbors + 1, random_state, "euclidean", {}, knn_indices, knn_dists
+    )
+
+    labels = np.zeros(n_vertices, dtype=np.int32)
+    intersection = CategoricalIntersection(graph, far_dist=5.0)
+    intersection.update(labels)
+    labels[:2] = 1
+    graph = intersection.update(labels).tocoo()
+
+    init_transform(
+        knn_indices[:, 1:].copy(),
+        random_state.uniform(size=(n_vertices, n_neighbors)).astype(np.float32),
+        X,
+    )
+
+    epochs_per_sample = make_epochs_per_sample(graph.data, 2)
+    rng_state = random_state.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+    runs = [(False, False, "sampling"), (True, False, "sampling"), (True, True, "sampling")]
+    if n_components == 3:
+        runs.append((True, False, "grid"))
+    for parallel, deterministic, repulsion in runs:
+        embedding = X.copy(order="C")
+        LayoutOptimization(
+            embedding,
+            embedding,
+            graph.row,
+            graph.col,
+            2,
+            n_vertices,
+            epochs_per_sample,
+            1.577,
+            0.895,
+            rng_state.copy(),
+            parallel=parallel,
+            deterministic=deterministic,
+            repulsion=repulsion,
+            grid_size=8,
+        ).step()
+    if verbose:
+        print(f"Warmed up embedding kernels in {time.time() - t0:.2f} sec")
 
 
 def find_ab_params(spread, min_dist):
@@ -1287,6 +2552,20 @@ class UMAP(BaseEstimator):
         embedded.  If you have more duplicates than you have n_neighbour
         you can have the identical data points lying in different regions of
         your space.  It also violates the definition of a metric.
+
+    deterministic: bool (optional, default False)
+        Optimize the layout with the parallel SGD variant whose result, for a
+        fixed ``random_state``, does not depend on the number of threads.
+
+    vertex_order: str (optional, default None)
+        If "rcm", optimize the layout with the embedding rows in reverse
+        Cuthill-McKee order of the graph for better memory locality.
+
+    repulsion: str (optional, default "sampling")
+        The repulsion engine of the layout optimization: "sampling" (negative
+        sampling) or "grid" (sampled near field plus FFT far field, 3-D
+        embeddings only). It can be overridden per run with the
+        ``repulsion`` keyword of ``embed``.
     """
 
     def __init__(
@@ -1321,6 +2600,9 @@ class UMAP(BaseEstimator):
         parallel = True,
         verbose=False,
         unique=False,
+        deterministic=False,
+        vertex_order=None,
+        repulsion="sampling",
     ):
         self.n_neighbors = n_neighbors
         self.metric = metric
@@ -1353,6 +2635,9 @@ class UMAP(BaseEstimator):
         self.transform_seed = transform_seed
         self.force_approximation_algorithm = force_approximation_algorithm
         self.parallel = parallel
+        self.deterministic = deterministic
+        self.vertex_order = vertex_order
+        self.repulsion = repulsion
         self.verbose = verbose
         self.unique = unique
 
@@ -1362,6 +2647,8 @@ class UMAP(BaseEstimator):
         self.input_data: np.ndarray = None
         self.flow: ActivationFlow = None
         self.scoord: xa.DataArray = None
+        self._graph_cache = None
+        self._label_intersection = None
 
 
     def set_embedding(self, embed_ : np.ndarray ):
@@ -1550,7 +2837,124 @@ class UMAP(BaseEstimator):
         # True if metric returns iterable of length 2, False otherwise
         return hasattr(metric_out, "__iter__") and len(metric_out) == 2
 
-    def spectral_embed(self, X: np.ndarray, nnd: NNDescent, y: np.ndarray = None, **kwargs):
+    def _unsupervised_graph(self, X, nnd: "NNDescent", random_state, nn_metric):
+        """Return the fuzzy simplicial set of the kNN graph in ``nnd``,
+        reusing the one built by the previous call when neither the
+        neighbor index nor the graph parameters have changed.
+
+        The returned matrix is shared with the cache and must not be
+        modified in place.
+        """
+        key = (
+            X.shape,
+            self.n_neighbors,
+            str(nn_metric),
+            self.set_op_mix_ratio,
+            self.local_connectivity,
+            self.angular_rp_forest,
+        )
+        if self._graph_cache is not None:
+            cached_nnd, cached_key, graph = self._graph_cache
+            if (cached_nnd is nnd) and (cached_key == key):
+                return graph
+
+        self._knn_indices, self._knn_dists = nnd.neighbor_graph
+        self._rp_forest = nnd
+        graph, self._sigmas, self._rhos = fuzzy_simplicial_set(
+            X,
+            self.n_neighbors,
+            random_state,
+            nn_metric,
+            self._metric_kwds,
+            self._knn_indices,
+            self._knn_dists,
+            self.angular_rp_forest,
+            self.set_op_mix_ratio,
+            self.local_connectivity,
+            True,
+            self.verbose,
+        )
+        self._graph_cache = (nnd, key, graph)
+        return graph
+
+    def clear_graph_cache(self):
+        self._graph_cache = None
+        self._label_intersection = None
+
+    def _supervised_graph(self, graph, X, y, random_state, cache=True):
+        """Intersect a copy of the unsupervised ``graph`` with the target
+        ``y``; the intersection routines modify their input in place.
+        Categorical targets go through an incrementally updated
+        ``CategoricalIntersection`` kept alongside the cached graph, unless
+        ``cache`` is False (graphs other than the cached one)."""
+        if y is None:
+            return graph.copy()
+
+        # Currently not checking if any duplicate points have differing labels
+        # Might be worth throwing a warning...
+        len_X = len(X) if not self._sparse_data else X.shape[0]
+        if len_X != len(y):
+            raise ValueError(
+                "Length of x = {len_x}, length of y = {len_y}, while it must be equal.".format(
+                    len_x=len_X, len_y=len(y)
+                )
+            )
+        y_ = check_array(y, ensure_2d=False)
+        if self.target_metric == "categorical":
+            if self.target_weight < 1.0:
+                far_dist = 2.5 * (1.0 / (1.0 - self.target_weight))
+            else:
+                far_dist = 1.0e12
+            if not cache:
+                return discrete_metric_simplicial_set_intersection(
+                    graph.copy(), y_, far_dist=far_dist
+                )
+            if (self._label_intersection is None) or not self._label_intersection.matches(graph, far_dist=far_dist):
+                self._label_intersection = CategoricalIntersection(graph, far_dist=far_dist)
+            if self._label_intersection.symmetric:
+                return self._label_intersection.update(y_)
+            return discrete_metric_simplicial_set_intersection(
+                graph.copy(), y_, far_dist=far_dist
+            )
+        elif self.target_metric in dist.DISCRETE_METRICS:
+            if self.target_weight < 1.0:
+                scale = 2.5 * (1.0 / (1.0 - self.target_weight))
+            else:
+                scale = 1.0e12
+
+            metric_kws = dist.get_discrete_params(y_, self.target_metric)
+            return discrete_metric_simplicial_set_intersection(
+                graph.copy(),
+                y_,
+                metric=self.target_metric,
+                metric_kws=metric_kws,
+                metric_scale=scale,
+            )
+        else:
+            if len(y_.shape) == 1:
+                y_ = y_.reshape(-1, 1)
+            if self.target_n_neighbors == -1:
+                target_n_neighbors = self.n_neighbors
+            else:
+                target_n_neighbors = self.target_n_neighbors
+
+            target_graph, target_sigmas, target_rhos = fuzzy_simplicial_set(
+                y_,
+                target_n_neighbors,
+                random_state,
+                self.target_metric,
+                self._target_metric_kwds,
+                None,
+                None,
+                False,
+                1.0,
+                1.0,
+                False,
+            )
+            graph = general_simplicial_set_intersection( graph, target_graph, self.target_weight )
+            return reset_local_connectivity(graph)
+
+    def spectral_embed(self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray = None, **kwargs):
         """Fit X into an embedded space.
 
         Optionally use y for supervised dimension reduction.
@@ -1618,6 +3022,8 @@ class UMAP(BaseEstimator):
         if self.verbose:
             print("Construct fuzzy simplicial set")
 
+        from pynndescent.distances import named_distances as pynn_named_distances
+        from pynndescent.sparse import sparse_named_distances as pynn_sparse_named_distances
         if self._sparse_data and self.metric in pynn_sparse_named_distances:
             nn_metric = self.metric
         elif not self._sparse_data and self.metric in pynn_named_distances:
@@ -1625,79 +3031,10 @@ class UMAP(BaseEstimator):
         else:
             nn_metric = self._input_distance_func
 
-        self._knn_indices, self._knn_dists = nnd.neighbor_graph
-        self._rp_forest = nnd
         t1 = time.time()
-        self.graph_, self._sigmas, self._rhos = fuzzy_simplicial_set(
-            X,
-            self.n_neighbors,
-            random_state,
-            nn_metric,
-            self._metric_kwds,
-            self._knn_indices,
-            self._knn_dists,
-            self.angular_rp_forest,
-            self.set_op_mix_ratio,
-            self.local_connectivity,
-            True,
-            self.verbose,
-        )
+        graph = self._unsupervised_graph(X, nnd, random_state, nn_metric)
         t2 = time.time()
-        if y is not None:
-            len_X = len(X) if not self._sparse_data else X.shape[0]
-            if len_X != len(y):
-                raise ValueError(
-                    "Length of x = {len_x}, length of y = {len_y}, while it must be equal.".format(
-                        len_x=len_X, len_y=len(y)
-                    )
-                )
-            y_ = check_array(y, ensure_2d=False)
-            if self.target_metric == "categorical":
-                if self.target_weight < 1.0:
-                    far_dist = 2.5 * (1.0 / (1.0 - self.target_weight))
-                else:
-                    far_dist = 1.0e12
-                self.graph_ = discrete_metric_simplicial_set_intersection(
-                    self.graph_, y_, far_dist=far_dist
-                )
-            elif self.target_metric in dist.DISCRETE_METRICS:
-                if self.target_weight < 1.0:
-                    scale = 2.5 * (1.0 / (1.0 - self.target_weight))
-                else:
-                    scale = 1.0e12
-
-                metric_kws = dist.get_discrete_params(y_, self.target_metric)
-
-                self.graph_ = discrete_metric_simplicial_set_intersection(
-                    self.graph_,
-                    y_,
-                    metric=self.target_metric,
-                    metric_kws=metric_kws,
-                    metric_scale=scale,
-                )
-            else:
-                if len(y_.shape) == 1:
-                    y_ = y_.reshape(-1, 1)
-                if self.target_n_neighbors == -1:
-                    target_n_neighbors = self.n_neighbors
-                else:
-                    target_n_neighbors = self.target_n_neighbors
-
-                target_graph, target_sigmas, target_rhos = fuzzy_simplicial_set(
-                    y_,
-                    target_n_neighbors,
-                    random_state,
-                    self.target_metric,
-                    self._target_metric_kwds,
-                    None,
-                    None,
-                    False,
-                    1.0,
-                    1.0,
-                    False,
-                )
-                self.graph_ = general_simplicial_set_intersection( self.graph_, target_graph, self.target_weight )
-                self.graph_ = reset_local_connectivity(self.graph_)
+        self.graph_ = self._supervised_graph(graph, X, y, random_state)
 
         t3 = time.time()
         if self.verbose: print(ts(), "Construct embedding")
@@ -1707,7 +3044,7 @@ class UMAP(BaseEstimator):
         self._input_hash = joblib.hash(self._raw_data)
         return self
 
-    def embed( self, X: np.ndarray, nnd: NNDescent, y: np.ndarray=None, **kwargs ):
+    def embed( self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray=None, **kwargs ):
         """Fit X into an embedded space.
 
         Optionally use y for supervised dimension reduction.
@@ -1726,7 +3063,128 @@ class UMAP(BaseEstimator):
             The relevant attributes are ``target_metric`` and
             ``target_metric_kwds``.
         """
-        progress_callback = kwargs.get('progress_callback')
+        layout = self.embed_layout(X, nnd, y, **kwargs)
+        self._embedding_ = layout.run(
+            progress_callback=kwargs.get('progress_callback'),
+            callback_interval=kwargs.get('callback_interval', 0),
+            frame_rate=kwargs.get('frame_rate', 0.0),
+        )
+        return self
+
+    def embed_task( self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray=None, **kwargs ):
+        """Prepare the embedding as ``embed`` does, then optimize it in a
+        background thread. ``embedding`` tracks the optimization in place
+        while the task runs.
+
+        Returns
+        -------
+        task: LayoutTask
+            The started task, which can be paused, resumed or cancelled.
+        """
+        layout = self.embed_layout(X, nnd, y, **kwargs)
+        task = LayoutTask(
+            layout,
+            progress_callback=kwargs.get('progress_callback'),
+            callback_interval=kwargs.get('callback_interval', 0),
+            frame_rate=kwargs.get('frame_rate', 0.0),
+            on_complete=kwargs.get('on_complete'),
+        )
+        return task.start()
+
+    def embed_layout( self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray=None, **kwargs ):
+        """Build the graph and initial embedding for ``embed`` and return the
+        ``LayoutOptimization`` that refines it, without running any epochs."""
+        init, random_state = self._embedding_graph(X, nnd, y)
+
+        nepochs = kwargs.get( 'nepochs', self.n_epochs )
+        init_alpha = kwargs.get( 'alpha', self._initial_alpha )
+        print( f"Computing umap embedding with nepochs = {nepochs}, alpha = {init_alpha}, nLabels = {0 if y is None else np.count_nonzero( y > 0 )}" )
+        return self._simplicial_set_layout( self.graph_, nepochs, init_alpha, init, random_state, repulsion=kwargs.get( 'repulsion', self.repulsion ) )
+
+    def embed_landmarks( self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray=None, n_landmarks: int=10000, landmark_epochs: int=None, refine_epochs: int=20, **kwargs ):
+        """Embed a coarse to fine approximation of ``embed``: a landmark
+        subset spread over the kNN graph of ``nnd`` (``select_landmarks``) is
+        embedded first, using the fuzzy graph of its own kNN graph
+        (``landmark_graph``) intersected with the targets ``y`` of the
+        landmarks as in ``embed``, and the other points are placed from their
+        landmark neighbors (``landmark_placement``). The resulting full embedding is available
+        from ``embedding`` on return and is refined by a short optimization
+        of the full graph in a background task.
+
+        Parameters
+        ----------
+        n_landmarks: int (optional, default 10000)
+            The number of landmarks.
+
+        landmark_epochs: int (optional, default None)
+            The number of epochs for the landmark embedding, by default
+            ``nepochs`` or ``n_epochs``.
+
+        refine_epochs: int (optional, default 20)
+            The number of epochs of the full resolution refinement.
+
+        Other keyword arguments are those of ``embed_task``.
+
+        Returns
+        -------
+        task: LayoutTask
+            The started refinement task.
+        """
+        t0 = time.time()
+        init, random_state = self._embedding_graph(X, nnd, y)
+        graph = self.graph_.tocsr()
+        init_alpha = kwargs.get( 'alpha', self._initial_alpha )
+        landmark_epochs = landmark_epochs or kwargs.get( 'nepochs', self.n_epochs )
+
+        landmarks = select_landmarks( nnd.neighbor_graph[0], n_landmarks, random_state )
+        lgraph = landmark_graph( X[landmarks], self.n_neighbors, random_state, self.metric, self._metric_kwds, self.set_op_mix_ratio, self.local_connectivity )
+        if y is not None:
+            lgraph = self._supervised_graph( lgraph, X[landmarks], np.asarray( y )[landmarks], random_state, cache=False ).tocoo()
+        landmark_init = init[landmarks] if isinstance( init, np.ndarray ) else init
+        print( f"Embedding {landmarks.shape[0]} landmarks of {X.shape[0]} points, landmark graph nnz = {lgraph.nnz}, nepochs = {landmark_epochs}")
+
+        landmark_embedding = self._simplicial_set_layout( lgraph, landmark_epochs, init_alpha, landmark_init, random_state, X[landmarks] ).run()
+        embedding = landmark_placement( graph, landmarks, landmark_embedding, random_state )
+        t1 = time.time()
+        print( f"Placed {X.shape[0]} points from landmarks in {t1-t0:.2f} sec, refining for {refine_epochs} epochs")
+
+        layout = self._simplicial_set_layout( self.graph_, refine_epochs, init_alpha, embedding, random_state, repulsion=kwargs.get( 'repulsion', self.repulsion ) )
+        task = LayoutTask(
+            layout,
+            progress_callback=kwargs.get('progress_callback'),
+            callback_interval=kwargs.get('callback_interval', 0),
+            frame_rate=kwargs.get('frame_rate', 0.0),
+            on_complete=kwargs.get('on_complete'),
+        )
+        return task.start()
+
+    def _simplicial_set_layout( self, graph, nepochs, init_alpha, init, random_state, data=None, repulsion="sampling" ) -> "LayoutOptimization":
+        self._init_embedding_, layout = simplicial_set_layout(
+            self._raw_data if data is None else data,  # JH why raw data?
+            graph,
+            self.n_components,
+            init_alpha,
+            self._a,
+            self._b,
+            self.repulsion_strength,
+            self.negative_sample_rate,
+            nepochs,
+            init,
+            random_state,
+            self._input_distance_func,
+            self._metric_kwds,
+            self.parallel,
+            self.verbose,
+            self.deterministic,
+            self.vertex_order,
+            repulsion,
+        )
+        self._embedding_ = layout.head_embedding
+        return layout
+
+    def _embedding_graph( self, X: np.ndarray, nnd: "NNDescent", y: np.ndarray=None ):
+        """Set up the parameters of an embedding of X and build its fuzzy
+        graph ``graph_``; returns the initialization and random state."""
         X = check_array(X, dtype=np.float32, accept_sparse="csr", order="C")
         self._raw_data = X
 
@@ -1754,6 +3212,8 @@ class UMAP(BaseEstimator):
             X.sort_indices()
 
         random_state = check_random_state(self.random_state)
+        from pynndescent.distances import named_distances as pynn_named_distances
+        from pynndescent.sparse import sparse_named_distances as pynn_sparse_named_distances
         if self._sparse_data and self.metric in pynn_sparse_named_distances:
             nn_metric = self.metric
         elif not self._sparse_data and self.metric in pynn_named_distances:
@@ -1761,108 +3221,41 @@ class UMAP(BaseEstimator):
         else:
             nn_metric = self._input_distance_func
 
-        self._knn_indices, self._knn_dists = nnd.neighbor_graph
-        self._rp_forest = nnd
-
-        self.graph_, self._sigmas, self._rhos = fuzzy_simplicial_set(
-            X,
-            self.n_neighbors,
-            random_state,
-            nn_metric,
-            self._metric_kwds,
-            self._knn_indices,
-            self._knn_dists,
-            self.angular_rp_forest,
-            self.set_op_mix_ratio,
-            self.local_connectivity,
-            True,
-            self.verbose,
-        )
-
-        # Currently not checking if any duplicate points have differing labels
-        # Might be worth throwing a warning...
-        if y is not None:
-            len_X = len(X) if not self._sparse_data else X.shape[0]
-            if len_X != len(y):
-                raise ValueError(
-                    "Length of x = {len_x}, length of y = {len_y}, while it must be equal.".format(
-                        len_x=len_X, len_y=len(y)
-                    )
-                )
-            y_ = check_array(y, ensure_2d=False)
-            if self.target_metric == "categorical":
-                if self.target_weight < 1.0:
-                    far_dist = 2.5 * (1.0 / (1.0 - self.target_weight))
-                else:
-                    far_dist = 1.0e12
-                self.graph_ = discrete_metric_simplicial_set_intersection(
-                    self.graph_, y_, far_dist=far_dist
-                )
-            elif self.target_metric in dist.DISCRETE_METRICS:
-                if self.target_weight < 1.0:
-                    scale = 2.5 * (1.0 / (1.0 - self.target_weight))
-                else:
-                    scale = 1.0e12
-
-                metric_kws = dist.get_discrete_params(y_, self.target_metric)
-                self.graph_ = discrete_metric_simplicial_set_intersection(
-                    self.graph_,
-                    y_,
-                    metric=self.target_metric,
-                    metric_kws=metric_kws,
-                    metric_scale=scale,
-                )
-            else:
-                if len(y_.shape) == 1:
-                    y_ = y_.reshape(-1, 1)
-                if self.target_n_neighbors == -1:
-                    target_n_neighbors = self.n_neighbors
-                else:
-                    target_n_neighbors = self.target_n_neighbors
-
-                target_graph, target_sigmas, target_rhos = fuzzy_simplicial_set(
-                    y_,
-                    target_n_neighbors,
-                    random_state,
-                    self.target_metric,
-                    self._target_metric_kwds,
-                    None,
-                    None,
-                    False,
-                    1.0,
-                    1.0,
-                    False,
-                )
-
-                self.graph_ = general_simplicial_set_intersection( self.graph_, target_graph, self.target_weight )
-                self.graph_ = reset_local_connectivity(self.graph_)
+        graph = self._unsupervised_graph(X, nnd, random_state, nn_metric)
+        self.graph_ = self._supervised_graph(graph, X, y, random_state)
 
         if self.verbose:
             print(ts(), "Construct embedding")
+        self._input_hash = joblib.hash(self._raw_data)
+        return init, random_state
 
-        nepochs = kwargs.get( 'nepochs', self.n_epochs )
-        init_alpha = kwargs.get( 'alpha', self._initial_alpha )
-        print( f"Computing umap embedding with nepochs = {nepochs}, alpha = {init_alpha}, nLabels = {np.count_nonzero( y > 0 )}" )
-        self._init_embedding_, self._embedding_ = simplicial_set_embedding(
-            self._raw_data,  # JH why raw data?
-            self.graph_,
-            self.n_components,
-            init_alpha,
-            self._a,
-            self._b,
-            self.repulsion_strength,
-            self.negative_sample_rate,
-            nepochs,
-            init,
-            random_state,
-            self._input_distance_func,
-            self._metric_kwds,
-            self.parallel,
-            self.verbose,
-        )
+    def append(self, X):
+        """Add new samples to an existing embedding, placing them with
+        ``transform`` against the current neighbor index and embedding.
+        Existing points keep their indices and coordinates.
+
+        Parameters
+        ----------
+        X : array, shape (n_new_samples, n_features)
+            New data to be appended.
 
+        Returns
+        -------
+        X_new : array, shape (n_new_samples, n_components)
+            Embedding of the appended samples.
+        """
+        new_embedding = self.transform(X, assume_new=True)
+        X = check_array(X, dtype=np.float32, accept_sparse="csr", order="C")
+        self._embedding_ = np.concatenate( [ self.embedding, new_embedding ] ).astype( np.float32 )
+        self._init_embedding_ = None
+        self._graph_cache = None
+        self._label_intersection = None
+        shared_input = self.input_data is self._raw_data
+        self._raw_data = np.concatenate( [ self._raw_data, X ] )
+        if shared_input:                    self.input_data = self._raw_data
+        elif self.input_data is not None:   self.input_data = np.concatenate( [ self.input_data, X ] )
         self._input_hash = joblib.hash(self._raw_data)
-        return self
+        return new_embedding
 
     def fit_transform(self, X, y=None):
         """Fit X into an embedded space and return that transformed
@@ -1888,7 +3281,7 @@ class UMAP(BaseEstimator):
         self.fit(X, y)
         return self.embedding
 
-    def transform(self, X):
+    def transform(self, X, assume_new=False):
         """Transform X into the existing embedded space and return that
         transformed output.
 
@@ -1897,6 +3290,10 @@ class UMAP(BaseEstimator):
         X : array, shape (n_samples, n_features)
             New data to be transformed.
 
+        assume_new : bool (optional, default False)
+            The caller guarantees that X is not the training data, so the
+            check that hashes all of X to short circuit that case is skipped.
+
         Returns
         -------
         X_new : array, shape (n_samples, n_components)
@@ -1909,19 +3306,109 @@ class UMAP(BaseEstimator):
             )
         # If we just have the original input then short circuit things
         X = check_array(X, dtype=np.float32, accept_sparse="csr", order="C")
-        x_hash = joblib.hash(X)
-        if x_hash == self._input_hash:
-            return self.embedding
+        if not assume_new:
+            x_hash = joblib.hash(X)
+            if x_hash == self._input_hash:
+                return self.embedding
 
         if self.metric == "precomputed":
             raise ValueError(
                 "Transform  of new data not available for precomputed metric."
             )
 
-        # X = check_array(X, dtype=np.float32, order="C", accept_sparse="csr")
         random_state = check_random_state(self.transform_seed)
         rng_state = random_state.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+        n_epochs = self._transform_epochs(X.shape[0])
+        return self._transform_chunk(
+            X,
+            self.embedding.astype(np.float32, copy=True),  # Fixes #179 & #217,
+            n_epochs,
+            rng_state,
+            self.random_state is None,
+        )
+
+    def transform_batches(self, X, batch_size=10000, n_epochs=None, n_threads=None, assume_new=True):
+        """Transform X into the existing embedded space in batches that are
+        processed concurrently, yielding the coordinates of each batch, in
+        order, as soon as it is done. The embedding stays fixed, so the
+        result of a batch does not depend on the other batches.
+
+        Parameters
+        ----------
+        X : array, shape (n_samples, n_features)
+            New data to be transformed.
+
+        batch_size : int (optional, default 10000)
+            The number of samples per batch.
 
+        n_epochs : int (optional, default None)
+            The fixed number of optimization epochs per batch, by default
+            that of ``transform`` for a batch of ``batch_size`` samples.
+
+        n_threads : int (optional, default None)
+            The number of batches processed concurrently, by default the
+            number of cpus. Each batch runs the serial layout kernel, which
+            releases the GIL.
+
+        assume_new : bool (optional, default True)
+            As for ``transform``.
+
+        Yields
+        ------
+        start : int
+            The index in X of the first sample of the batch.
+
+        X_new : array, shape (n_batch_samples, n_components)
+            Embedding of the batch in low-dimensional space.
+        """
+        if self.embedding.shape[0] == 1:
+            raise ValueError(
+                "Transform unavailable when model was fit with only a single data sample."
+            )
+        if self.metric == "precomputed":
+            raise ValueError(
+                "Transform  of new data not available for precomputed metric."
+            )
+        X = check_array(X, dtype=np.float32, accept_sparse="csr", order="C")
+        if not assume_new and (joblib.hash(X) == self._input_hash):
+            yield 0, self.embedding
+            return
+
+        if n_epochs is None:
+            n_epochs = self._transform_epochs(min(batch_size, X.shape[0]))
+        n_threads = n_threads or os.cpu_count() or 1
+        reference = self.embedding.astype(np.float32, copy=True)
+        seeds = check_random_state(self.transform_seed).randint(
+            INT32_MIN, INT32_MAX, (math.ceil(X.shape[0] / batch_size), 3)
+        ).astype(np.int64)
+
+        t0 = time.time()
+        # Prepare the search index once before it is queried from several threads
+        self._rp_forest.query(X[:1], self.n_neighbors)
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            pending = deque()
+            for ib, start in enumerate(range(0, X.shape[0], batch_size)):
+                pending.append((start, executor.submit(
+                    self._transform_chunk, X[start:start + batch_size], reference, n_epochs, seeds[ib], False
+                )))
+                if len(pending) > 2 * n_threads:
+                    start, future = pending.popleft()
+                    yield start, future.result()
+            while pending:
+                start, future = pending.popleft()
+                yield start, future.result()
+        if self.verbose:
+            print(ts(), f"Transformed {X.shape[0]} samples in {time.time()-t0:.2f} sec")
+
+    def _transform_epochs(self, n_samples):
+        if self.n_epochs == 0:
+            # For smaller datasets we can use more epochs
+            return 100 if n_samples <= 10000 else 30
+        return int(self.n_epochs // 3.0)
+
+    def _transform_chunk(self, X, reference, n_epochs, rng_state, parallel):
+        """Embed the samples X against the fixed ``reference`` embedding of
+        the training data, as ``transform`` does."""
         indices, dists = self._rp_forest.query(X, self.n_neighbors)
         dists = dists.astype(np.float32, order="C")
 
@@ -1936,16 +3423,7 @@ class UMAP(BaseEstimator):
         csr_graph = normalize(graph.tocsr(), norm="l1")
         inds = csr_graph.indices.reshape(X.shape[0], self.n_neighbors)
         weights = csr_graph.data.reshape(X.shape[0], self.n_neighbors)
-        embedding = init_transform(inds, weights, self.embedding)
-
-        if self.n_epochs == 0:
-            # For smaller datasets we can use more epochs
-            if graph.shape[0] <= 10000:
-                n_epochs = 100
-            else:
-                n_epochs = 30
-        else:
-            n_epochs = int(self.n_epochs // 3.0)
+        embedding = init_transform(inds, weights, reference)
 
         graph.data[graph.data < (graph.data.max() / float(n_epochs))] = 0.0
         graph.eliminate_zeros()
@@ -1954,17 +3432,11 @@ class UMAP(BaseEstimator):
 
         head = graph.row
         tail = graph.col
-        weight = graph.data
-
-        # optimize_layout = make_optimize_layout(
-        #     self._output_distance_func,
-        #     tuple(self.output_metric_kwds.values()),
-        # )
 
         if self.output_metric == "euclidean":
             embedding = optimize_layout_euclidean(
                 embedding,
-                self.embedding.astype(np.float32, copy=True),  # Fixes #179 & #217,
+                reference,
                 head,
                 tail,
                 n_epochs,
@@ -1976,13 +3448,14 @@ class UMAP(BaseEstimator):
                 self.repulsion_strength,
                 self._initial_alpha / 4.0,
                 self.negative_sample_rate,
-                self.random_state is None,
+                parallel,
                 verbose=self.verbose,
+                move_other=False,
             )
         else:
             embedding = optimize_layout_generic(
                 embedding,
-                self.embedding.astype(np.float32, copy=True),  # Fixes #179 & #217
+                reference,
                 head,
                 tail,
                 n_epochs,
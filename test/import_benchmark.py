@@ -0,0 +1,78 @@
+import subprocess, sys, json, os, tempfile
+from typing import Dict
+import numpy as np, xarray as xa
+
+# Cold-start cost of the Astrolab().gui() startup path, measured in a fresh interpreter per run on a small synthetic
+# project that already contains its reduction, for the current tree and for a baseline.  gui() builds the kNN graph and
+# the initial embedding, so the first start also pays for numba compilation; cold and warm (cached kernels) starts are
+# reported separately.
+# Usage: python test/import_benchmark.py [ baseline revision or source tree [ current source tree ] ]
+# The default baseline is the revision before the lazy-import change.
+heavy_modules = [ "tensorflow", "keras", "pynndescent", "itkwidgets", "bokeh" ]
+nruns = 6
+nsamples, nbands, ndim = 5000, 200, 16
+repo_dir = os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) )
+
+probe = f"""
+import sys, os, time, json
+t0 = time.time()
+from astrolab.gui.application import Astrolab
+from astrolab.data.manager import DataManager
+from astrolab.model.labels import LabelsManager
+t1 = time.time()
+DataManager.instance( cache_dir=sys.argv[1], project_name="benchmark", reduce_method="Autoencoder", model_dims={ndim}, subsample=1 )
+LabelsManager.instance().setLabels( [ ( 'Unlabeled', [1.0, 1.0, 1.0, 0.5] ), ( 'Class-1', [1.0, 0.0, 0.0, 1.0] ), ( 'Class-2', [0.0, 0.0, 1.0, 1.0] ) ] )
+error = None
+try:                        Astrolab.instance( config_file=os.path.join( sys.argv[1], "configuration.py" ) ).gui()
+except Exception as err:    error = f"{{type(err).__name__}}: {{err}}"
+t2 = time.time()
+print( json.dumps( dict( import_time=t1-t0, gui_time=t2-t1, error=error, loaded=[ m for m in {heavy_modules!r} if m in sys.modules ] ) ) )
+"""
+
+def make_project( cache_dir: str ):
+    random_state = np.random.RandomState(0)
+    samples, bands = np.arange( nsamples ), np.arange( nbands )
+    data_vars = dict(
+        embedding = xa.DataArray( random_state.rand( nsamples, nbands ).astype( np.float32 ), dims=[ 'samples', 'bands' ] ),
+        reduction = xa.DataArray( random_state.rand( nsamples, ndim ).astype( np.float32 ), dims=[ 'samples', 'model' ], coords=dict( model=np.arange( ndim ) ) ),
+        target_names = xa.DataArray( np.array( [ f"target-{i % 100}" for i in samples ] ), dims=[ 'samples' ] ),
+        obsids = xa.DataArray( np.array( [ f"obs-{i}" for i in samples ] ), dims=[ 'samples' ] ) )
+    data_vars['plot-x'] = xa.DataArray( bands.astype( np.float32 ), dims=[ 'bands' ] )
+    data_vars['plot-y'] = data_vars['embedding']
+    dataset = xa.Dataset( data_vars, coords=dict( samples=samples, bands=bands ), attrs=dict( type='spectra', colnames=[ 'target_names', 'obsids' ] ) )
+    os.makedirs( os.path.join( cache_dir, "benchmark" ), exist_ok=True )
+    dataset.to_netcdf( os.path.join( cache_dir, "benchmark", f"Autoencoder-{ndim}-ss1.nc" ) )
+
+def git( *args ) -> str:
+    return subprocess.run( [ "git", "-C", repo_dir ] + list(args), capture_output=True, text=True, check=True ).stdout.strip()
+
+def run_probe( tree: str, numba_cache_dir: str ) -> Dict:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        make_project( cache_dir )
+        env = dict( os.environ, PYTHONPATH=tree, NUMBA_CACHE_DIR=numba_cache_dir )
+        result = subprocess.run( [ sys.executable, "-c", probe, cache_dir ], capture_output=True, text=True, env=env, cwd=cache_dir )
+    if result.returncode != 0:
+        print( result.stderr )
+        sys.exit( result.returncode )
+    return json.loads( result.stdout.strip().splitlines()[-1] )
+
+baseline = sys.argv[1] if len( sys.argv ) > 1 else git( "log", "--format=%H", "--grep", r"^\[user-010\]", "-n", "1" ) + "^"
+current_tree = sys.argv[2] if len( sys.argv ) > 2 else repo_dir
+with tempfile.TemporaryDirectory() as work_dir:
+    baseline_tree = baseline if os.path.isdir( baseline ) else os.path.join( work_dir, "baseline" )
+    if not os.path.isdir( baseline ):
+        os.makedirs( baseline_tree )
+        subprocess.run( f"git -C {repo_dir} archive {baseline} astrolab | tar -x -C {baseline_tree}", shell=True, check=True )
+    trees = { f"baseline ({os.path.basename(baseline)[:12]})": baseline_tree, "current": current_tree }
+    # Run 0 of each tree starts with an empty numba cache (first start after install); later runs reuse the kernels
+    # it cached.  The trees alternate so that drift in machine load affects both alike.
+    totals = { label: [] for label in trees }
+    for irun in range( nruns ):
+        for label, tree in trees.items():
+            stats = run_probe( tree, os.path.join( work_dir, f"numba-{list(trees).index(label)}" ) )
+            totals[label].append( stats['import_time'] + stats['gui_time'] )
+            print( f"{label} {'cold' if irun == 0 else 'warm'} run {irun}: import {stats['import_time']:.2f} sec, gui() {stats['gui_time']:.2f} sec, heavy modules loaded: {stats['loaded']}" )
+            if stats['error']: print( f"   gui() failed: {stats['error']}" )
+(baseline_cold, *baseline_warm), (current_cold, *current_warm) = totals.values()
+print( f"Cold start time of import + gui(): baseline {baseline_cold:.2f} sec, current {current_cold:.2f} sec, speedup {baseline_cold/current_cold:.2f}x" )
+print( f"Median warm start time of import + gui(): baseline {np.median(baseline_warm):.2f} sec, current {np.median(current_warm):.2f} sec, speedup {np.median(baseline_warm)/np.median(current_warm):.2f}x" )
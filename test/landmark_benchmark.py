@@ -0,0 +1,58 @@
+import time, sys
+import numpy as np
+from pynndescent import NNDescent
+from sklearn.datasets import make_blobs
+from sklearn.manifold import trustworthiness
+from sklearn.neighbors import NearestNeighbors
+from astrolab.reduction.umap import UMAP
+
+# Time and trustworthiness of the landmark (coarse to fine) embedding relative to the full UMAP embedding, for 3-D
+# layouts of synthetic clustered data. Trustworthiness is measured on a random subsample, for the placement from the
+# landmarks (before refinement) and after the full resolution refinement. The supervised runs label a fraction of the
+# points with two classes that split every cluster in half, which only the labels can separate; the class agreement is
+# the fraction of the embedding neighbors of a point that share its class.
+n_samples = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100000
+landmark_counts = [ int( n ) for n in sys.argv[2:] ] or [ 1000, 10000 ]
+n_features = 16
+n_neighbors = 15
+n_epochs = 200
+refine_epochs = 20
+n_eval = 5000
+labeled_fraction = 0.5
+
+# Clusters with a 3-D intrinsic structure, linearly embedded in the feature space, so that a 3-D layout can be trustworthy
+X, labels, centers = make_blobs( n_samples, 3, centers=20, cluster_std=1.0, center_box=( -20.0, 20.0 ), random_state=0, return_centers=True )
+classes = ( X[:,0] > centers[labels,0] ).astype( np.int32 )
+X = ( X @ np.random.RandomState(0).normal( size=( 3, n_features ) ) ).astype( np.float32 )
+t0 = time.time()
+nnd = NNDescent( X, n_neighbors=n_neighbors, random_state=0 )
+print( f"kNN graph of {n_samples} points built in {time.time()-t0:.2f} sec")
+eval_ids = np.random.RandomState(1).choice( n_samples, n_eval, replace=False )
+y = np.where( np.random.RandomState(2).rand( n_samples ) < labeled_fraction, classes, -1 ).astype( np.int32 )
+
+def trust( embedding: np.ndarray ) -> float:
+    return trustworthiness( X[eval_ids].astype( np.float64 ), embedding[eval_ids].astype( np.float64 ), n_neighbors=n_neighbors )
+
+def class_agreement( embedding: np.ndarray ) -> float:
+    neighbors = NearestNeighbors( n_neighbors=n_neighbors+1 ).fit( embedding[eval_ids] ).kneighbors( embedding[eval_ids], return_distance=False )[:,1:]
+    return np.mean( classes[eval_ids][neighbors] == classes[eval_ids][:,None] )
+
+def quality( embedding: np.ndarray ) -> str:
+    return f"trustworthiness = {trust( embedding ):.4f}, class agreement = {class_agreement( embedding ):.4f}"
+
+for target in ( None, y ):
+    print( "unsupervised:" if target is None else f"supervised, {np.count_nonzero( target >= 0 )} labeled points:" )
+    mapper = UMAP( n_neighbors=n_neighbors, n_components=3, n_epochs=n_epochs, random_state=0 )
+    t0 = time.time()
+    mapper.embed( X, nnd, target )
+    print( f"full      : {time.time()-t0:.2f} sec, {quality( mapper.embedding )}")
+
+    for n_landmarks in landmark_counts:
+        mapper = UMAP( n_neighbors=n_neighbors, n_components=3, n_epochs=n_epochs, random_state=0 )
+        t0 = time.time()
+        task = mapper.embed_landmarks( X, nnd, target, n_landmarks=n_landmarks, refine_epochs=refine_epochs )
+        t1 = time.time()
+        placed = task.layout.head_embedding.copy()      # the refinement may already have started its first epoch
+        task.wait()
+        t2 = time.time()
+        print( f"{n_landmarks:6} landmarks: placed in {t1-t0:.2f} sec, {quality( placed )}; refined in {t2-t0:.2f} sec, {quality( task.layout.head_embedding )}")
@@ -0,0 +1,46 @@
+import time, sys
+import numpy as np, scipy.sparse
+from astrolab.reduction.umap import LayoutOptimization, make_epochs_per_sample, INT32_MIN, INT32_MAX
+
+# Epochs/sec of the UMAP SGD kernel on a synthetic 1M-point graph: the vertices of a 100^3 lattice, each linked to its
+# 6 lattice neighbors plus a few random ones, with vertex ids shuffled so that graph neighbors are scattered in memory as in a kNN graph.
+grid_size = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+n_random = 4
+n_epochs = 10
+n_components = 3
+
+random_state = np.random.RandomState(0)
+n_vertices = grid_size ** 3
+vid = random_state.permutation( n_vertices ).reshape( grid_size, grid_size, grid_size )
+rows, cols = [], []
+for axis in range(3):
+    src = np.take( vid, np.arange( grid_size-1 ), axis=axis ).ravel()
+    dst = np.take( vid, np.arange( 1, grid_size ), axis=axis ).ravel()
+    rows.extend( [ src, dst ] ); cols.extend( [ dst, src ] )
+src = np.repeat( np.arange( n_vertices ), n_random )
+dst = random_state.randint( 0, n_vertices, src.shape[0] )
+rows.extend( [ src, dst ] ); cols.extend( [ dst, src ] )
+row, col = np.concatenate( rows ), np.concatenate( cols )
+graph = scipy.sparse.coo_matrix( ( random_state.uniform( 0.05, 1.0, row.shape[0] ).astype( np.float32 ), ( row, col ) ), shape=( n_vertices, n_vertices ) )
+graph.sum_duplicates()
+epochs_per_sample = make_epochs_per_sample( graph.data, n_epochs )
+init_embedding = random_state.uniform( 0.0, 10.0, ( n_vertices, n_components ) ).astype( np.float32 )
+rng_state = random_state.randint( INT32_MIN, INT32_MAX, 3 ).astype( np.int64 )
+print( f"Graph: {n_vertices} vertices, {graph.nnz} edges, {n_epochs} epochs per run")
+
+configurations = dict(
+    coo_order = dict( sort_edges=False ),
+    head_order = dict( sort_edges=True ),
+    rcm_order = dict( sort_edges=True, vertex_order="rcm" ),
+)
+for parallel in ( False, True ):
+    for name, options in configurations.items():
+        embedding = init_embedding.copy()
+        t0 = time.time()
+        layout = LayoutOptimization( embedding, embedding, graph.row, graph.col, n_epochs, n_vertices, epochs_per_sample, 1.577, 0.895, rng_state.copy(), parallel=parallel, **options )
+        t1 = time.time()
+        layout.step()                       # compiles (or loads) the kernel for these argument types
+        t2 = time.time()
+        while not layout.completed: layout.step()
+        t3 = time.time()
+        print( f"parallel={parallel!s:5} {name:10}: setup {t1-t0:.2f} sec, first epoch {t2-t1:.2f} sec, {(n_epochs-1)/(t3-t2):.2f} epochs/sec")
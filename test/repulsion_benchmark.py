@@ -0,0 +1,62 @@
+import time, sys
+import numpy as np
+from pynndescent import NNDescent
+from sklearn.datasets import make_blobs
+from sklearn.manifold import trustworthiness
+from sklearn.metrics import silhouette_score
+from sklearn.neighbors import NearestNeighbors
+from astrolab.reduction.umap import LayoutOptimization, fuzzy_simplicial_set, make_epochs_per_sample, find_ab_params, INT32_MIN, INT32_MAX
+
+# Epoch time and embedding quality of the grid (FFT) repulsion engine relative to negative sampling, for 3-D layouts
+# of synthetic clustered data. Quality is measured on a random subsample: trustworthiness, recall of the input space
+# kNN in the embedding, and silhouette of the cluster labels. The grid engine is accepted when each metric is within
+# the stated tolerance of the sampling result.
+n_samples = int( sys.argv[1] ) if len( sys.argv ) > 1 else 200000
+n_features = 16
+n_clusters = 20
+n_neighbors = 15
+n_epochs = 200
+n_eval = 5000
+tolerance = dict( trustworthiness=0.02, knn_recall=0.05, silhouette=0.05 )
+
+random_state = np.random.RandomState(0)
+X, labels = make_blobs( n_samples, n_features, centers=n_clusters, cluster_std=2.0, random_state=0 )
+X = X.astype( np.float32 )
+t0 = time.time()
+nnd = NNDescent( X, n_neighbors=n_neighbors, random_state=0 )
+knn_indices, knn_dists = nnd.neighbor_graph
+graph, sigmas, rhos = fuzzy_simplicial_set( X, n_neighbors, random_state, "euclidean", {}, knn_indices, knn_dists )
+graph = graph.tocoo()
+graph.sum_duplicates()
+graph.data[ graph.data < ( graph.data.max() / float( n_epochs ) ) ] = 0.0
+graph.eliminate_zeros()
+epochs_per_sample = make_epochs_per_sample( graph.data, n_epochs )
+a, b = find_ab_params( 1.0, 0.1 )
+init_embedding = random_state.uniform( 0.0, 10.0, ( n_samples, 3 ) ).astype( np.float32 )
+rng_state = random_state.randint( INT32_MIN, INT32_MAX, 3 ).astype( np.int64 )
+eval_ids = random_state.choice( n_samples, n_eval, replace=False )
+print( f"Graph: {n_samples} vertices, {graph.nnz} edges, built in {time.time()-t0:.2f} sec")
+
+def knn_recall( X_eval: np.ndarray, Y_eval: np.ndarray, k: int = n_neighbors ) -> float:
+    x_nn = NearestNeighbors( n_neighbors=k+1 ).fit( X_eval ).kneighbors( X_eval, return_distance=False )[:,1:]
+    y_nn = NearestNeighbors( n_neighbors=k+1 ).fit( Y_eval ).kneighbors( Y_eval, return_distance=False )[:,1:]
+    return np.mean( [ len( np.intersect1d( x_nn[i], y_nn[i] ) ) / k for i in range( X_eval.shape[0] ) ] )
+
+results = {}
+for repulsion in ( "sampling", "grid" ):
+    embedding = init_embedding.copy()
+    layout = LayoutOptimization( embedding, embedding, graph.row, graph.col, n_epochs, n_samples, epochs_per_sample, a, b, rng_state.copy(), parallel=True, repulsion=repulsion )
+    layout.step()                           # compiles (or loads) the kernels
+    t1 = time.time()
+    while not layout.completed: layout.step()
+    epoch_time = ( time.time() - t1 ) / ( n_epochs - 1 )
+    X_eval, Y_eval = X[eval_ids], layout.head_embedding[eval_ids]
+    results[repulsion] = dict(
+        trustworthiness = trustworthiness( X_eval.astype( np.float64 ), Y_eval.astype( np.float64 ), n_neighbors=n_neighbors ),
+        knn_recall = knn_recall( X_eval, Y_eval ),
+        silhouette = silhouette_score( Y_eval, labels[eval_ids] ) )
+    print( f"{repulsion:8}: {epoch_time:.3f} sec/epoch, " + ", ".join( f"{name} = {value:.4f}" for name, value in results[repulsion].items() ) )
+
+for name, tol in tolerance.items():
+    delta = results["grid"][name] - results["sampling"][name]
+    print( f"{name}: grid - sampling = {delta:+.4f}, tolerance = {tol}: {'ok' if delta >= -tol else 'FAILED'}")
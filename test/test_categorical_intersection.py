@@ -0,0 +1,36 @@
+import numpy as np, pytest
+from astrolab.reduction.umap import CategoricalIntersection, discrete_metric_simplicial_set_intersection, fuzzy_simplicial_set
+
+# The incrementally updated label intersection must reproduce the full recomputation exactly after every relabelling.
+n_samples, n_features, n_neighbors, n_classes = 500, 8, 10, 4
+
+@pytest.fixture( scope="module" )
+def graph():
+    random_state = np.random.RandomState(0)
+    X = random_state.normal( size=( n_samples, n_features ) ).astype( np.float32 )
+    distances = np.sqrt( ( ( X[:,None,:] - X[None,:,:] ) ** 2 ).sum( axis=2 ) )
+    knn_indices = np.argsort( distances, axis=1 )[:,:n_neighbors].astype( np.int32 )
+    knn_dists = np.take_along_axis( distances, knn_indices, axis=1 ).astype( np.float32 )
+    graph, sigmas, rhos = fuzzy_simplicial_set( X, n_neighbors, random_state, "euclidean", {}, knn_indices, knn_dists )
+    return graph
+
+def full_intersection( graph, labels: np.ndarray, far_dist: float ) -> np.ndarray:
+    return discrete_metric_simplicial_set_intersection( graph.copy(), labels, far_dist=far_dist ).toarray()
+
+@pytest.mark.parametrize( "far_dist", [ 5.0, 1.0e12 ] )
+def test_incremental_matches_full( graph, far_dist: float ):
+    random_state = np.random.RandomState(1)
+    labels = np.full( n_samples, -1, dtype=np.int32 )
+    intersection = CategoricalIntersection( graph, far_dist=far_dist )
+    assert intersection.symmetric
+    for nchanged in [ 0, 1, 5, 50, n_samples ]:
+        changed = random_state.choice( n_samples, nchanged, replace=False )
+        labels[changed] = random_state.randint( -1, n_classes, nchanged )
+        result = intersection.update( labels ).toarray()
+        assert np.abs( result - full_intersection( graph, labels, far_dist ) ).max() == 0.0
+
+def test_update_leaves_graph_unchanged( graph ):
+    original = graph.copy()
+    intersection = CategoricalIntersection( graph )
+    intersection.update( np.arange( n_samples ) % n_classes )
+    assert ( graph != original ).nnz == 0
@@ -0,0 +1,36 @@
+import subprocess, sys, os, json
+import numpy as np, pytest
+
+# Deterministic layouts must not depend on the number of numba threads: the same optimization is run in fresh
+# interpreters with different NUMBA_NUM_THREADS and the embeddings compared bit for bit.
+repo_dir = os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) )
+
+probe = """
+import sys, json, numpy as np
+from astrolab.reduction.umap import LayoutOptimization, fuzzy_simplicial_set, make_epochs_per_sample, INT32_MIN, INT32_MAX
+n_samples, n_neighbors, n_epochs = 3000, 10, 20
+random_state = np.random.RandomState(0)
+X = random_state.normal( size=( n_samples, 3 ) ).astype( np.float32 )
+knn_indices = np.argsort( ( ( X[:,None,:] - X[None,:,:] ) ** 2 ).sum( axis=2 ), axis=1 )[:,:n_neighbors].astype( np.int32 )
+knn_dists = np.sqrt( ( ( X[:,None,:] - X[knn_indices] ) ** 2 ).sum( axis=2 ) ).astype( np.float32 )
+graph = fuzzy_simplicial_set( X, n_neighbors, random_state, "euclidean", {}, knn_indices, knn_dists )[0].tocoo()
+epochs_per_sample = make_epochs_per_sample( graph.data, n_epochs )
+embedding = random_state.uniform( 0.0, 10.0, ( n_samples, 3 ) ).astype( np.float32 )
+rng_state = random_state.randint( INT32_MIN, INT32_MAX, 3 ).astype( np.int64 )
+layout = LayoutOptimization( embedding, embedding, graph.row, graph.col, n_epochs, n_samples, epochs_per_sample, 1.577, 0.895, rng_state,
+                             parallel=True, deterministic=True, block_size=256 )
+while not layout.completed: layout.step()
+print( json.dumps( layout.head_embedding.tobytes().hex() ) )
+"""
+
+def run_layout( nthreads: int, cache_dir: str ) -> np.ndarray:
+    env = dict( os.environ, NUMBA_NUM_THREADS=str( nthreads ), NUMBA_CACHE_DIR=cache_dir, PYTHONPATH=os.pathsep.join( [ repo_dir, os.environ.get( 'PYTHONPATH', '' ) ] ) )
+    result = subprocess.run( [ sys.executable, "-c", probe ], capture_output=True, text=True, env=env )
+    assert result.returncode == 0, result.stderr
+    return np.frombuffer( bytes.fromhex( json.loads( result.stdout.strip().splitlines()[-1] ) ), dtype=np.float32 )
+
+def test_deterministic_layout_independent_of_threads( tmp_path ):
+    embeddings = [ run_layout( nthreads, str( tmp_path / "numba" ) ) for nthreads in ( 1, 2, 4 ) ]
+    assert np.all( np.isfinite( embeddings[0] ) )
+    for embedding in embeddings[1:]:
+        assert np.array_equal( embedding, embeddings[0] )
@@ -0,0 +1,37 @@
+import numpy as np, xarray as xa, pytest
+from astrolab.data.manager import DataManager
+from astrolab.data.inputs import write_dataset, compact_vars, blocked
+
+# A small project written in zarr format, in memory and streamed in blocks, must reopen with the values it was written with.
+pytest.importorskip( "zarr" )
+nsamples, nbands = 50, 8
+
+@pytest.fixture
+def dataManager( tmp_path ):
+    dataManager = DataManager.instance()
+    saved = { name: getattr( dataManager, name ) for name in ( 'cache_dir', 'project_name', 'dataset_format', 'zarr_chunk_size', 'zarr_compressor' ) }
+    dataManager.cache_dir, dataManager.project_name, dataManager.dataset_format, dataManager.zarr_chunk_size = str( tmp_path ), "test", "zarr", 20
+    yield dataManager
+    dataManager.evictDataset()
+    for name, value in saved.items(): setattr( dataManager, name, value )
+
+def make_dataset( block_size: int ) -> xa.Dataset:
+    random_state = np.random.RandomState(0)
+    samples = np.arange( nsamples )
+    data_vars = dict(
+        embedding = xa.DataArray( blocked( random_state.rand( nsamples, nbands ), block_size ), dims=[ 'samples', 'bands' ] ),
+        target_names = xa.DataArray( np.array( [ f"target-{i % 7}" for i in samples ] ), dims=[ 'samples' ] ) )
+    return xa.Dataset( compact_vars( data_vars ), coords=dict( samples=samples, bands=np.arange( nbands ) ), attrs=dict( type='spectra' ) )
+
+@pytest.mark.parametrize( "block_size", [ 0, 10 ] )
+@pytest.mark.parametrize( "compressor", [ "zstd", "none" ] )
+def test_write_and_reopen( dataManager, block_size: int, compressor: str ):
+    dataManager.zarr_compressor = compressor
+    dataset = make_dataset( block_size )
+    output_file = write_dataset( dataset, dataManager.datasetFile( "project" )[:-len(".zarr")], block_size )
+    assert output_file.endswith( ".zarr" ) and ( dataManager.datasetFile( "project" ) == output_file )
+    reopened = dataManager.loadDataset( "project" )
+    assert reopened.sizes['samples'] == nsamples
+    np.testing.assert_array_equal( reopened['embedding'].values, dataset['embedding'].values.astype( np.float32 ) )
+    np.testing.assert_array_equal( reopened['target_names'].values, dataset['target_names'].values )
+    np.testing.assert_array_equal( DataManager.getCategories( reopened, 'target_names' ), dataset['target_names-categories'].values )